@@ -1,6 +1,7 @@
 import discord
 from discord.ext import commands
 
+from app.core.database import MongoDBService
 from app.core.logger import get_logger
 from app.core.settings import Settings
 from app.core.chat_model import ChatModelService
@@ -34,9 +35,10 @@ if __name__ == "__main__":
 
     chat_model_service = ChatModelService(settings=settings)
 
-    bot.add_command(DonateHandler().discord_handler())
-    bot.add_command(FacialHandler(chat_model_service).discord_handler())
-    bot.add_command(TarotHandler(chat_model_service).discord_handler())
-    bot.add_command(ZiweiHandler(chat_model_service).discord_handler())
+    with MongoDBService(settings) as mongodb_service:
+        bot.add_command(DonateHandler().discord_handler())
+        bot.add_command(FacialHandler(chat_model_service, mongodb_service, settings).discord_handler())
+        bot.add_command(TarotHandler(chat_model_service, mongodb_service, settings).discord_handler())
+        bot.add_command(ZiweiHandler(chat_model_service, mongodb_service, settings).discord_handler())
 
-    bot.run(settings.discord_bot_token, log_handler=None)
+        bot.run(settings.discord_bot_token, log_handler=None)
@@ -0,0 +1,53 @@
+from datetime import datetime, timedelta, timezone
+from typing import ClassVar
+
+import pymongo
+import pymongo.collection
+
+from app.core.database import MongoDBService
+
+
+class FileReferenceService:
+    telegram = "telegram"
+    discord = "discord"
+
+    # Discord CDN attachment URLs are signed and expire after roughly a day
+    ttls: ClassVar[dict[str, timedelta | None]] = {telegram: None, discord: timedelta(hours=12)}
+
+    def __init__(self, mongodb_service: MongoDBService):
+        self.client = mongodb_service.client
+        self.references: dict[tuple[str, str], tuple[str, datetime | None]] = {}
+        self.collection.create_index("expires_at", expireAfterSeconds=0)
+
+    @property
+    def collection(self) -> pymongo.collection.Collection:
+        return self.client["bap-be-bot"]["file-references"]
+
+    def get(self, platform: str, key: str) -> str | None:
+        now = datetime.now(timezone.utc)
+        if (platform, key) not in self.references:
+            document = self.collection.find_one({"_id": {"platform": platform, "key": key}})
+            if not document:
+                return None
+            expires_at = document.get("expires_at")
+            self.references[(platform, key)] = (document["reference"], expires_at.replace(tzinfo=timezone.utc) if expires_at else None)
+
+        reference, expires_at = self.references[(platform, key)]
+        if expires_at and expires_at <= now:
+            del self.references[(platform, key)]
+            return None
+        return reference
+
+    def set(self, platform: str, key: str, reference: str):
+        ttl = self.ttls[platform]
+        expires_at = datetime.now(timezone.utc) + ttl if ttl else None
+        self.references[(platform, key)] = (reference, expires_at)
+        self.collection.update_one(
+            {"_id": {"platform": platform, "key": key}},
+            {"$set": {"reference": reference, "expires_at": expires_at}},
+            upsert=True,
+        )
+
+    def delete(self, platform: str, key: str):
+        self.references.pop((platform, key), None)
+        self.collection.delete_one({"_id": {"platform": platform, "key": key}})
@@ -0,0 +1,21 @@
+import pytest
+
+from app.bot.file_reference import FileReferenceService
+from app.core.database import MongoDBService
+
+
+class TestFileReference:
+    @pytest.fixture
+    def file_reference_service(self, mongodb_service: MongoDBService):
+        return FileReferenceService(mongodb_service)
+
+    def test_set_get(self, file_reference_service: FileReferenceService):
+        platform, key = FileReferenceService.telegram, "the_magician:0"
+        file_reference_service.set(platform, key, "file-id")
+        assert file_reference_service.get(platform, key) == "file-id"
+
+        file_reference_service.references.clear()
+        assert file_reference_service.get(platform, key) == "file-id"
+
+        file_reference_service.delete(platform, key)
+        assert file_reference_service.get(platform, key) is None
@@ -6,8 +6,11 @@ import discord
 from discord.ext.commands.context import Context
 from telegram import InputMediaPhoto, Update
 from telegram.constants import ChatAction, MessageLimit
+from telegram.error import BadRequest
 from tenacity import retry, stop_after_attempt, wait_fixed
 
+from app.bot.file_reference import FileReferenceService
+
 
 def with_retry():
     return retry(wait=wait_fixed(1), stop=stop_after_attempt(3))
@@ -49,6 +52,7 @@ class TextMessage(BotMessage):
 class ImageMessage(BotMessage):
     image: BytesIO
     caption: str | None = None
+    filename: str = "image.png"
 
     @with_retry()
     async def reply_telegram(self, update):
@@ -61,7 +65,7 @@ class ImageMessage(BotMessage):
 
     @with_retry()
     async def reply_discord(self, ctx):
-        file_ = discord.File(self.image, filename="image.png")
+        file_ = discord.File(self.image, filename=self.filename)
         async with ctx.typing():
             await ctx.reply(file=file_, content=self.caption[:2000] if self.caption else None)
 
@@ -70,22 +74,72 @@ class ImageMessage(BotMessage):
 class ImageAlbumMessage(BotMessage):
     images: list[BytesIO]
     caption: str | None = None
+    keys: list[str] | None = None
 
     @with_retry()
-    async def reply_telegram(self, update):
+    async def reply_telegram(self, update, file_reference_service: FileReferenceService | None = None):
+        platform = FileReferenceService.telegram
+        references = self.get_references(platform, file_reference_service)
+
         await update.message.reply_chat_action(ChatAction.UPLOAD_PHOTO)
-        medias = [InputMediaPhoto(image) for image in self.images]
-        await update.message.reply_media_group(
+        try:
+            messages = await self.reply_media_group(update, references)
+        except BadRequest:
+            if not any(references):
+                raise
+            # Telegram rejects file ids it no longer knows, so forget them and upload the images instead
+            references = self.delete_references(platform, references, file_reference_service)
+            messages = await self.reply_media_group(update, references)
+
+        if file_reference_service and self.keys:
+            for key, reference, message in zip(self.keys, references, messages):
+                if not reference and message.photo:
+                    file_reference_service.set(platform, key, message.photo[-1].file_id)
+
+    @with_retry()
+    async def reply_discord(self, ctx, file_reference_service: FileReferenceService | None = None):
+        platform = FileReferenceService.discord
+        references = self.get_references(platform, file_reference_service)
+
+        if all(references):
+            embeds = [discord.Embed().set_image(url=reference) for reference in references]
+            try:
+                async with ctx.typing():
+                    await ctx.reply(embeds=embeds, content=self.caption[:2000] if self.caption else None)
+                return
+            except discord.HTTPException:
+                self.delete_references(platform, references, file_reference_service)
+
+        files = [discord.File(image, filename=f"image{i}.png") for i, image in enumerate(self.images)]
+        async with ctx.typing():
+            message = await ctx.reply(files=files, content=self.caption[:2000] if self.caption else None)
+
+        if file_reference_service and self.keys:
+            for key, attachment in zip(self.keys, message.attachments):
+                file_reference_service.set(platform, key, attachment.url)
+
+    async def reply_media_group(self, update, references: list[str | None]):
+        medias = []
+        for image, reference in zip(self.images, references):
+            image.seek(0)
+            medias.append(InputMediaPhoto(reference or image))
+        return await update.message.reply_media_group(
             media=medias,
             caption=self.caption[:MessageLimit.CAPTION_LENGTH] if self.caption else None,
             reply_to_message_id=update.message.id,
         )
 
-    @with_retry()
-    async def reply_discord(self, ctx):
-        files = [discord.File(image, filename=f"image{i}.png") for i, image in enumerate(self.images)]
-        async with ctx.typing():
-            await ctx.reply(files=files, content=self.caption[:2000] if self.caption else None)
+    def get_references(self, platform: str, file_reference_service: FileReferenceService | None):
+        if not file_reference_service or not self.keys:
+            return [None] * len(self.images)
+        return [file_reference_service.get(platform, key) for key in self.keys]
+
+    def delete_references(self, platform: str, references: list[str | None], file_reference_service: FileReferenceService | None):
+        if file_reference_service and self.keys:
+            for key, reference in zip(self.keys, references):
+                if reference:
+                    file_reference_service.delete(platform, key)
+        return [None] * len(self.images)
 
 
 @dataclass
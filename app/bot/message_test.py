@@ -0,0 +1,48 @@
+import asyncio
+from io import BytesIO
+from types import SimpleNamespace
+
+from telegram import InputFile
+from telegram.error import BadRequest
+
+from app.bot.file_reference import FileReferenceService
+from app.bot.message import ImageAlbumMessage
+
+
+class FakeFileReferenceService:
+    def __init__(self, references: dict[tuple[str, str], str]):
+        self.references = references
+
+    def get(self, platform: str, key: str) -> str | None:
+        return self.references.get((platform, key))
+
+    def set(self, platform: str, key: str, reference: str):
+        self.references[(platform, key)] = reference
+
+    def delete(self, platform: str, key: str):
+        self.references.pop((platform, key), None)
+
+
+class TestMessage:
+    def test_image_album_stale_reference(self):
+        sent = []
+
+        async def reply_chat_action(action):
+            pass
+
+        async def reply_media_group(media, caption, reply_to_message_id):
+            sent.append([item.media for item in media])
+            if any(isinstance(item.media, str) for item in media):
+                raise BadRequest("Wrong file identifier/http url specified")
+            return [SimpleNamespace(photo=[SimpleNamespace(file_id=f"new-{i}")]) for i, _ in enumerate(media)]
+
+        update = SimpleNamespace(message=SimpleNamespace(id=1, reply_chat_action=reply_chat_action, reply_media_group=reply_media_group))
+        platform = FileReferenceService.telegram
+        file_reference_service = FakeFileReferenceService({(platform, "the_fool:0"): "stale"})
+        album = ImageAlbumMessage(images=[BytesIO(b"fool"), BytesIO(b"magician")], keys=["the_fool:0", "the_magician:0"])
+
+        asyncio.run(album.reply_telegram(update, file_reference_service))
+        assert len(sent) == 2 and sent[0][0] == "stale"
+        assert all(isinstance(media, InputFile) for media in sent[1])
+        assert [media.input_file_content for media in sent[1]] == [b"fool", b"magician"]
+        assert file_reference_service.references == {(platform, "the_fool:0"): "new-0", (platform, "the_magician:0"): "new-1"}
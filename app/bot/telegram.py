@@ -45,11 +45,11 @@ if __name__ == "__main__":
         user_handler = UserHandler(mongodb_service)
 
         application.add_handler(DonateHandler().telegram_handler())
-        application.add_handler(FacialHandler(chat_model_service).telegram_handler())
-        application.add_handler(TarotHandler(chat_model_service).telegram_handler())
+        application.add_handler(FacialHandler(chat_model_service, mongodb_service, settings).telegram_handler())
+        application.add_handler(TarotHandler(chat_model_service, mongodb_service, settings).telegram_handler())
         application.add_handler(user_handler.message_handler())
         application.add_handler(user_handler.command_handler())
-        application.add_handler(ZiweiHandler(chat_model_service).telegram_handler())
+        application.add_handler(ZiweiHandler(chat_model_service, mongodb_service, settings).telegram_handler())
         application.add_error_handler(on_error)
 
         application.run_polling()
@@ -1,4 +1,10 @@
+import asyncio
+from collections.abc import AsyncIterator, Callable
+from threading import BoundedSemaphore
+
 import pytest
+from langchain_core.messages import AIMessage
+from langchain_core.runnables import Runnable, RunnableLambda
 
 from app.core.database import MongoDBService
 from app.core.settings import Settings
@@ -15,7 +21,43 @@ def chat_model_service(settings: Settings):
     return ChatModelService(settings)
 
 
+class FakeChatModel(RunnableLambda):
+    def __init__(self, invoke: Callable, structured_output: Callable | None = None):
+        super().__init__(invoke)
+        self.structured_output = structured_output
+
+    def with_structured_output(self, schema: type, **kwargs) -> Runnable:
+        # Looked up per call, so a test can clear structured_output to assert the model is no longer asked
+        def invoke(input):
+            assert self.structured_output, f"Unexpected {schema.__name__} request"
+            return self.structured_output(input)
+
+        return RunnableLambda(invoke)
+
+
+class FakeChatModelService(ChatModelService):
+    def __init__(self, chat_model: FakeChatModel, max_concurrency: int = 8):
+        self.chat_model = chat_model
+        self.semaphore = BoundedSemaphore(max_concurrency)
+
+
+@pytest.fixture
+def fake_chat_model_service() -> Callable[..., ChatModelService]:
+    def build(invoke: Callable = lambda prompt: AIMessage(content=""), structured_output: Callable | None = None) -> ChatModelService:
+        return FakeChatModelService(FakeChatModel(invoke, structured_output))
+
+    return build
+
+
 @pytest.fixture
 def mongodb_service(settings: Settings):
     with MongoDBService(settings) as mongodb_service:
         yield mongodb_service
+
+
+@pytest.fixture
+def run_graph() -> Callable[[AsyncIterator], list]:
+    async def collect(updates: AsyncIterator) -> list:
+        return [update async for update in updates]
+
+    return lambda updates: asyncio.run(collect(updates))
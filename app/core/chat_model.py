@@ -1,8 +1,15 @@
 from abc import ABC
+from threading import BoundedSemaphore
+
+from langchain_core.runnables import Runnable, RunnableConfig, RunnableLambda
 from langchain_google_genai import ChatGoogleGenerativeAI, HarmCategory, HarmBlockThreshold
+from langgraph.types import RetryPolicy
 
 from app.core.settings import Settings
 
+# Retries are per task, so a transient model error re-runs only the failing node or Send branch
+chat_model_retry_policy = RetryPolicy(max_attempts=3)
+
 
 class ChatModelService:
     def __init__(self, settings: Settings, model="gemini-2.0-flash", temperature=1.0):
@@ -20,6 +27,7 @@ class ChatModelService:
             safety_settings=safety_settings,
             google_api_key=settings.google_api_key,
         )
+        self.semaphore = BoundedSemaphore(settings.chat_model_max_concurrency)
 
 
 class ChatModelNode(ABC):
@@ -27,3 +35,11 @@ class ChatModelNode(ABC):
 
     def __init__(self, chat_model_service: ChatModelService):
         self.chat_model_service = chat_model_service
+
+    def limit(self, runnable: Runnable) -> Runnable:
+        # Every model call takes the process-wide semaphore, so concurrent readings and fan-outs share one limit
+        def invoke(input, config: RunnableConfig):
+            with self.chat_model_service.semaphore:
+                return runnable.invoke(input, config)
+
+        return RunnableLambda(invoke)
@@ -0,0 +1,261 @@
+import asyncio
+import hashlib
+from collections.abc import AsyncIterator, Iterator, Sequence
+from datetime import datetime, timedelta, timezone
+from typing import Any
+
+from bson import Binary
+from langchain_core.runnables import RunnableConfig
+from langgraph.checkpoint.base import (
+    WRITES_IDX_MAP,
+    BaseCheckpointSaver,
+    ChannelVersions,
+    Checkpoint,
+    CheckpointMetadata,
+    CheckpointTuple,
+    get_checkpoint_id,
+    get_checkpoint_metadata,
+)
+from langgraph.checkpoint.serde.jsonplus import JsonPlusSerializer
+import pymongo
+import pymongo.collection
+
+from app.core.database import MongoDBService
+
+
+def checkpoint_thread_id(*keys: object) -> str:
+    return hashlib.sha1(":".join(map(str, keys)).encode()).hexdigest()
+
+
+class MongoDBCheckpointSaver(BaseCheckpointSaver):
+    # Checkpoints only matter while a run can still be retried
+    ttl = timedelta(days=1)
+    # Bot messages are delivered as they stream and may carry raw image buffers, so they are never persisted
+    transient_channels = frozenset({"bot_messages"})
+    # Only built-in types are revived from the database, each graph allowlists its own state models
+    serde = JsonPlusSerializer(allowed_msgpack_modules=None)
+
+    def __init__(self, mongodb_service: MongoDBService):
+        super().__init__()
+        self.client = mongodb_service.client
+        self.checkpoints.create_index(
+            [("thread_id", pymongo.ASCENDING), ("checkpoint_ns", pymongo.ASCENDING), ("checkpoint_id", pymongo.DESCENDING)],
+            unique=True,
+        )
+        self.blobs.create_index(
+            [
+                ("thread_id", pymongo.ASCENDING),
+                ("checkpoint_ns", pymongo.ASCENDING),
+                ("channel", pymongo.ASCENDING),
+                ("version", pymongo.ASCENDING),
+            ],
+            unique=True,
+        )
+        self.writes.create_index(
+            [
+                ("thread_id", pymongo.ASCENDING),
+                ("checkpoint_ns", pymongo.ASCENDING),
+                ("checkpoint_id", pymongo.ASCENDING),
+                ("task_id", pymongo.ASCENDING),
+                ("idx", pymongo.ASCENDING),
+            ],
+            unique=True,
+        )
+        for collection in (self.checkpoints, self.blobs, self.writes):
+            collection.create_index("expires_at", expireAfterSeconds=0)
+
+    @property
+    def checkpoints(self) -> pymongo.collection.Collection:
+        return self.client["bap-be-bot"]["checkpoints"]
+
+    @property
+    def blobs(self) -> pymongo.collection.Collection:
+        return self.client["bap-be-bot"]["checkpoint-blobs"]
+
+    @property
+    def writes(self) -> pymongo.collection.Collection:
+        return self.client["bap-be-bot"]["checkpoint-writes"]
+
+    def dumps(self, channel: str, value: Any) -> dict[str, Any]:
+        type_, data = self.serde.dumps_typed([] if channel in self.transient_channels else value)
+        return {"type": type_, "value": Binary(data)}
+
+    def loads(self, document: dict[str, Any]) -> Any:
+        return self.serde.loads_typed((document["type"], bytes(document["value"])))
+
+    def load_tuple(self, document: dict[str, Any]) -> CheckpointTuple:
+        thread_id, checkpoint_ns, checkpoint_id = document["thread_id"], document["checkpoint_ns"], document["checkpoint_id"]
+        checkpoint: Checkpoint = self.serde.loads_typed((document["type"], bytes(document["checkpoint"])))
+
+        channel_values = {}
+        if versions := checkpoint["channel_versions"]:
+            blobs = self.blobs.find(
+                {
+                    "thread_id": thread_id,
+                    "checkpoint_ns": checkpoint_ns,
+                    "$or": [{"channel": channel, "version": version} for channel, version in versions.items()],
+                }
+            )
+            for blob in blobs:
+                if blob["type"] != "empty":
+                    channel_values[blob["channel"]] = self.loads(blob)
+
+        writes = self.writes.find({"thread_id": thread_id, "checkpoint_ns": checkpoint_ns, "checkpoint_id": checkpoint_id})
+        writes = sorted(writes, key=lambda write: (write["task_path"], write["task_id"], write["idx"]))
+
+        parent_checkpoint_id = document.get("parent_checkpoint_id")
+        return CheckpointTuple(
+            config={"configurable": {"thread_id": thread_id, "checkpoint_ns": checkpoint_ns, "checkpoint_id": checkpoint_id}},
+            checkpoint={**checkpoint, "channel_values": channel_values},
+            metadata=self.serde.loads_typed((document["metadata_type"], bytes(document["metadata"]))),
+            parent_config=(
+                {"configurable": {"thread_id": thread_id, "checkpoint_ns": checkpoint_ns, "checkpoint_id": parent_checkpoint_id}}
+                if parent_checkpoint_id
+                else None
+            ),
+            pending_writes=[(write["task_id"], write["channel"], self.loads(write)) for write in writes],
+        )
+
+    def get_tuple(self, config: RunnableConfig) -> CheckpointTuple | None:
+        query = {"thread_id": config["configurable"]["thread_id"], "checkpoint_ns": config["configurable"].get("checkpoint_ns", "")}
+        if checkpoint_id := get_checkpoint_id(config):
+            query["checkpoint_id"] = checkpoint_id
+        document = self.checkpoints.find_one(query, sort=[("checkpoint_id", pymongo.DESCENDING)])
+        return self.load_tuple(document) if document else None
+
+    def list(
+        self,
+        config: RunnableConfig | None,
+        *,
+        filter: dict[str, Any] | None = None,
+        before: RunnableConfig | None = None,
+        limit: int | None = None,
+    ) -> Iterator[CheckpointTuple]:
+        query = {}
+        if config:
+            query["thread_id"] = config["configurable"]["thread_id"]
+            if (checkpoint_ns := config["configurable"].get("checkpoint_ns")) is not None:
+                query["checkpoint_ns"] = checkpoint_ns
+            if checkpoint_id := get_checkpoint_id(config):
+                query["checkpoint_id"] = checkpoint_id
+        if before and (before_checkpoint_id := get_checkpoint_id(before)):
+            query["checkpoint_id"] = {"$lt": before_checkpoint_id}
+
+        for document in self.checkpoints.find(query, sort=[("checkpoint_id", pymongo.DESCENDING)]):
+            if limit is not None and limit <= 0:
+                break
+            checkpoint_tuple = self.load_tuple(document)
+            if filter and not all(checkpoint_tuple.metadata.get(key) == value for key, value in filter.items()):
+                continue
+            if limit is not None:
+                limit -= 1
+            yield checkpoint_tuple
+
+    def put(
+        self,
+        config: RunnableConfig,
+        checkpoint: Checkpoint,
+        metadata: CheckpointMetadata,
+        new_versions: ChannelVersions,
+    ) -> RunnableConfig:
+        thread_id, checkpoint_ns = config["configurable"]["thread_id"], config["configurable"]["checkpoint_ns"]
+        expires_at = datetime.now(timezone.utc) + self.ttl
+        checkpoint = checkpoint.copy()
+        channel_values = checkpoint.pop("channel_values")
+
+        for channel, version in new_versions.items():
+            blob = self.dumps(channel, channel_values[channel]) if channel in channel_values else {"type": "empty", "value": Binary(b"")}
+            self.blobs.update_one(
+                {"thread_id": thread_id, "checkpoint_ns": checkpoint_ns, "channel": channel, "version": version},
+                {"$set": {**blob, "expires_at": expires_at}},
+                upsert=True,
+            )
+
+        type_, data = self.serde.dumps_typed(checkpoint)
+        metadata_type, metadata_data = self.serde.dumps_typed(get_checkpoint_metadata(config, metadata))
+        self.checkpoints.update_one(
+            {"thread_id": thread_id, "checkpoint_ns": checkpoint_ns, "checkpoint_id": checkpoint["id"]},
+            {
+                "$set": {
+                    "parent_checkpoint_id": config["configurable"].get("checkpoint_id"),
+                    "type": type_,
+                    "checkpoint": Binary(data),
+                    "metadata_type": metadata_type,
+                    "metadata": Binary(metadata_data),
+                    "expires_at": expires_at,
+                }
+            },
+            upsert=True,
+        )
+        return {"configurable": {"thread_id": thread_id, "checkpoint_ns": checkpoint_ns, "checkpoint_id": checkpoint["id"]}}
+
+    def put_writes(
+        self,
+        config: RunnableConfig,
+        writes: Sequence[tuple[str, Any]],
+        task_id: str,
+        task_path: str = "",
+    ) -> None:
+        thread_id, checkpoint_ns = config["configurable"]["thread_id"], config["configurable"].get("checkpoint_ns", "")
+        checkpoint_id = config["configurable"]["checkpoint_id"]
+        expires_at = datetime.now(timezone.utc) + self.ttl
+        operations = []
+        for idx, (channel, value) in enumerate(writes):
+            idx = WRITES_IDX_MAP.get(channel, idx)
+            document = {"channel": channel, **self.dumps(channel, value), "task_path": task_path, "expires_at": expires_at}
+            operations.append(
+                pymongo.UpdateOne(
+                    {
+                        "thread_id": thread_id,
+                        "checkpoint_ns": checkpoint_ns,
+                        "checkpoint_id": checkpoint_id,
+                        "task_id": task_id,
+                        "idx": idx,
+                    },
+                    # Regular writes are kept from the first attempt, special writes (errors, interrupts) are replaced
+                    {"$set": document} if idx < 0 else {"$setOnInsert": document},
+                    upsert=True,
+                )
+            )
+        if operations:
+            self.writes.bulk_write(operations, ordered=False)
+
+    def delete_thread(self, thread_id: str) -> None:
+        for collection in (self.checkpoints, self.blobs, self.writes):
+            collection.delete_many({"thread_id": thread_id})
+
+    async def aget_tuple(self, config: RunnableConfig) -> CheckpointTuple | None:
+        return await asyncio.to_thread(self.get_tuple, config)
+
+    async def alist(
+        self,
+        config: RunnableConfig | None,
+        *,
+        filter: dict[str, Any] | None = None,
+        before: RunnableConfig | None = None,
+        limit: int | None = None,
+    ) -> AsyncIterator[CheckpointTuple]:
+        checkpoint_tuples = await asyncio.to_thread(lambda: [*self.list(config, filter=filter, before=before, limit=limit)])
+        for checkpoint_tuple in checkpoint_tuples:
+            yield checkpoint_tuple
+
+    async def aput(
+        self,
+        config: RunnableConfig,
+        checkpoint: Checkpoint,
+        metadata: CheckpointMetadata,
+        new_versions: ChannelVersions,
+    ) -> RunnableConfig:
+        return await asyncio.to_thread(self.put, config, checkpoint, metadata, new_versions)
+
+    async def aput_writes(
+        self,
+        config: RunnableConfig,
+        writes: Sequence[tuple[str, Any]],
+        task_id: str,
+        task_path: str = "",
+    ) -> None:
+        await asyncio.to_thread(self.put_writes, config, writes, task_id, task_path)
+
+    async def adelete_thread(self, thread_id: str) -> None:
+        await asyncio.to_thread(self.delete_thread, thread_id)
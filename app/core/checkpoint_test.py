@@ -0,0 +1,64 @@
+import operator
+import time
+from typing import Annotated, TypedDict
+from uuid import uuid4
+
+import pytest
+from langchain_core.runnables import RunnableConfig
+from langgraph.checkpoint.base import BaseCheckpointSaver
+from langgraph.checkpoint.memory import InMemorySaver
+from langgraph.graph import StateGraph, START, END
+from langgraph.types import Send
+
+from app.core.checkpoint import MongoDBCheckpointSaver
+
+
+class CheckpointState(TypedDict):
+    arcs: list[str]
+    analyses: Annotated[list[str], operator.add]
+    bot_messages: Annotated[list[str], operator.add]
+
+
+class TestCheckpoint:
+    @pytest.fixture(params=["memory", pytest.param("mongodb", marks=pytest.mark.integration)])
+    def checkpointer(self, request: pytest.FixtureRequest):
+        if request.param == "memory":
+            return InMemorySaver()
+        return MongoDBCheckpointSaver(request.getfixturevalue("mongodb_service"))
+
+    def test_resume_failed_branch(self, checkpointer: BaseCheckpointSaver):
+        arcs, calls, failures = ["Mệnh", "Tài Bạch", "Quan Lộc"], [], {"Tài Bạch"}
+
+        def analyze(state: dict, config: RunnableConfig):
+            calls.append(state["arc"])
+            if state["arc"] in failures:
+                failures.remove(state["arc"])
+                # The failure ends the run, siblings still saving their writes would be cut short and re-run on resume
+                thread_config = {"configurable": {"thread_id": config["configurable"]["thread_id"]}}
+                for _ in range(500):
+                    if len({task_id for task_id, _, _ in checkpointer.get_tuple(thread_config).pending_writes}) == len(arcs) - 1:
+                        break
+                    time.sleep(0.01)
+                raise ConnectionError(state["arc"])
+            return {"analyses": [state["arc"]], "bot_messages": [state["arc"]]}
+
+        workflow = StateGraph(CheckpointState)
+        workflow.add_node("analyze", analyze)
+        workflow.add_conditional_edges(START, lambda state: [Send("analyze", {"arc": arc}) for arc in state["arcs"]], ["analyze"])
+        workflow.add_edge("analyze", END)
+        graph = workflow.compile(checkpointer=checkpointer)
+
+        config = {"configurable": {"thread_id": uuid4().hex}}
+        with pytest.raises(ConnectionError):
+            graph.invoke({"arcs": arcs}, config)
+        assert graph.get_state(config).next == ("analyze",)
+
+        calls.clear()
+        state = graph.invoke(None, config)
+        assert calls == ["Tài Bạch"]
+        assert sorted(state["analyses"]) == sorted(arcs)
+        if isinstance(checkpointer, MongoDBCheckpointSaver):
+            assert state["bot_messages"] == ["Tài Bạch"] and graph.get_state(config).values["bot_messages"] == []
+
+        checkpointer.delete_thread(config["configurable"]["thread_id"])
+        assert checkpointer.get_tuple(config) is None
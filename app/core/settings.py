@@ -10,3 +10,20 @@ class Settings(BaseSettings):
     discord_bot_token: str
 
     mongodb_uri: str
+
+    chat_model_max_concurrency: int = 8
+
+    tarot_graph_mode: str = "fanout"
+    tarot_max_concurrency: int = 3
+    tarot_composite: bool = True
+
+    ziwei_graph_mode: str = "fanout"
+    ziwei_chart_max_workers: int = 4
+
+    facial_graph_mode: str = "sequential"
+    facial_photo_min_edge: int = 600
+    facial_image_max_edge: int = 768
+    facial_image_format: str = "jpeg"
+    facial_image_quality: int = 85
+    facial_image_min_sharpness: float = 20.0
+    facial_image_max_workers: int = 2
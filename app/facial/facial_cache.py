@@ -0,0 +1,107 @@
+from datetime import datetime, timedelta, timezone
+from threading import Lock
+import time
+from typing import NamedTuple
+
+import pymongo
+import pymongo.collection
+
+from app.core.database import MongoDBService
+from app.core.logger import get_logger
+from app.facial.facial_model import FacialFeatures
+from app.utils.image import FaceHash
+
+logger = get_logger(__name__)
+
+HASH_BITS = 64
+BAND_BITS = 8
+
+
+class FacialReadingEntry(NamedTuple):
+    features: FacialFeatures
+    analysis: str
+
+
+def hash_bands(image_hash: int) -> list[str]:
+    mask = (1 << BAND_BITS) - 1
+    return [f"{band}:{image_hash >> (band * BAND_BITS) & mask:02x}" for band in range(HASH_BITS // BAND_BITS)]
+
+
+class FacialReadingCache:
+    ttl = timedelta(days=7)
+
+    def __init__(self, mongodb_service: MongoDBService, max_distance: int = 4, max_fine_distance: int = 32):
+        # A hash within max_distance bits of another shares at least one whole band with it, so bands narrow the lookup
+        if max_distance >= HASH_BITS // BAND_BITS:
+            raise ValueError(f"max_distance must be below {HASH_BITS // BAND_BITS}")
+        self.client = mongodb_service.client
+        self.max_distance = max_distance
+        self.max_fine_distance = max_fine_distance
+        self.lock = Lock()
+        self.hits = 0
+        self.misses = 0
+        self.rejections = 0
+        self.lookup_seconds = 0.0
+        self.collection.create_index("bands")
+        self.collection.create_index("expires_at", expireAfterSeconds=0)
+
+    @property
+    def collection(self) -> pymongo.collection.Collection:
+        return self.client["bap-be-bot"]["facial-readings"]
+
+    def get(self, image_hash: FaceHash) -> FacialReadingEntry | None:
+        start = time.perf_counter()
+        now = datetime.now(timezone.utc)
+        best, best_distances, rejections = None, (self.max_distance + 1, 0), 0
+        for document in self.collection.find({"bands": {"$in": hash_bands(image_hash.coarse)}}):
+            distance = (int(document["_id"], 16) ^ image_hash.coarse).bit_count()
+            expires_at = document["expires_at"].replace(tzinfo=timezone.utc)
+            # Readings keyed on whole-photo hashes have no fine hash and are left to expire
+            if distance > self.max_distance or expires_at <= now or "fine" not in document:
+                continue
+            fine_distance = (int(document["fine"], 16) ^ image_hash.fine).bit_count()
+            if fine_distance > self.max_fine_distance:
+                rejections += 1
+            elif (distance, fine_distance) < best_distances:
+                best, best_distances = document, (distance, fine_distance)
+
+        with self.lock:
+            self.lookup_seconds += time.perf_counter() - start
+            self.rejections += rejections
+            if best:
+                self.hits += 1
+            else:
+                self.misses += 1
+        logger.info(f"Facial reading cache {self.stats()}")
+        if not best:
+            return None
+
+        # Hits are counted per reading, so reuse at each distance can be audited for false matches
+        logger.info(f"Facial reading {best['_id']} reused at distance {best_distances}")
+        self.collection.update_one({"_id": best["_id"]}, {"$inc": {"hits": 1}, "$set": {"last_hit_at": now}})
+        return FacialReadingEntry(FacialFeatures.model_validate(best["features"]), best["analysis"])
+
+    def set(self, image_hash: FaceHash, entry: FacialReadingEntry):
+        self.collection.update_one(
+            {"_id": f"{image_hash.coarse:016x}"},
+            {
+                "$set": {
+                    "bands": hash_bands(image_hash.coarse),
+                    "fine": f"{image_hash.fine:064x}",
+                    "features": entry.features.model_dump(),
+                    "analysis": entry.analysis,
+                    "expires_at": datetime.now(timezone.utc) + self.ttl,
+                }
+            },
+            upsert=True,
+        )
+
+    def stats(self) -> dict[str, float]:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "rejections": self.rejections,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "lookup_ms": 1000 * self.lookup_seconds / lookups if lookups else 0.0,
+        }
@@ -1,41 +1,75 @@
+from enum import Enum
+
 from langgraph.graph import StateGraph, START, END
 
 from app.core.chat_model import ChatModelService
+from app.facial.facial_cache import FacialReadingCache
 from app.facial.facial_state import FacialTellingState
+from app.utils.image import FaceHash
 from app.facial.facial_node import (
     ExtractFacialFeatures,
     ValidateFacialFeatures,
     HandleFacialFeaturesExtractionError,
     DumpFacialFeatures,
     AnalyzeFacialFeatures,
+    ReadFacialFeatures,
+    DumpFacialAnalysis,
+    LookupFacialReading,
+    ValidateFacialReadingCached,
+    StoreFacialReading,
 )
 
 
+class FacialGraphMode(str, Enum):
+    sequential = "sequential"
+    single = "single"
+
+
 class FacialGraphService:
-    def __init__(self, chat_model_service: ChatModelService):
+    def __init__(
+        self,
+        chat_model_service: ChatModelService,
+        mode: FacialGraphMode = FacialGraphMode.sequential,
+        facial_reading_cache: FacialReadingCache | None = None,
+    ):
         workflow = StateGraph(FacialTellingState)
 
-        workflow.add_node(ExtractFacialFeatures.__name__, ExtractFacialFeatures(chat_model_service))
         workflow.add_node(HandleFacialFeaturesExtractionError.__name__, HandleFacialFeaturesExtractionError())
         workflow.add_node(DumpFacialFeatures.__name__, DumpFacialFeatures())
-        workflow.add_node(AnalyzeFacialFeatures.__name__, AnalyzeFacialFeatures(chat_model_service))
 
-        workflow.add_edge(START, ExtractFacialFeatures.__name__)
+        if mode == FacialGraphMode.single:
+            read_node_id, analyze_node_id = ReadFacialFeatures.__name__, DumpFacialAnalysis.__name__
+            workflow.add_node(read_node_id, ReadFacialFeatures(chat_model_service))
+            workflow.add_node(analyze_node_id, DumpFacialAnalysis())
+        else:
+            read_node_id, analyze_node_id = ExtractFacialFeatures.__name__, AnalyzeFacialFeatures.__name__
+            workflow.add_node(read_node_id, ExtractFacialFeatures(chat_model_service))
+            workflow.add_node(analyze_node_id, AnalyzeFacialFeatures(chat_model_service))
+
+        if facial_reading_cache:
+            workflow.add_node(LookupFacialReading.__name__, LookupFacialReading(facial_reading_cache))
+            workflow.add_node(StoreFacialReading.__name__, StoreFacialReading(facial_reading_cache))
+            workflow.add_edge(START, LookupFacialReading.__name__)
+            workflow.add_conditional_edges(LookupFacialReading.__name__, ValidateFacialReadingCached(), {True: END, False: read_node_id})
+            workflow.add_edge(analyze_node_id, StoreFacialReading.__name__)
+            workflow.add_edge(StoreFacialReading.__name__, END)
+        else:
+            workflow.add_edge(START, read_node_id)
+            workflow.add_edge(analyze_node_id, END)
 
         workflow.add_conditional_edges(
-            ExtractFacialFeatures.__name__,
+            read_node_id,
             ValidateFacialFeatures(),
             {True: HandleFacialFeaturesExtractionError.__name__, False: DumpFacialFeatures.__name__},
         )
         workflow.add_edge(HandleFacialFeaturesExtractionError.__name__, END)
-        workflow.add_edge(DumpFacialFeatures.__name__, AnalyzeFacialFeatures.__name__)
-        workflow.add_edge(AnalyzeFacialFeatures.__name__, END)
+        workflow.add_edge(DumpFacialFeatures.__name__, analyze_node_id)
 
         self.graph = workflow.compile()
 
-    def run(self, image_url: str):
-        initial_state = FacialTellingState(image_url=image_url)
+    async def run(self, image_url: str, image_hash: FaceHash | None = None):
+        initial_state = FacialTellingState(image_url=image_url, image_hash=image_hash)
         state: dict[str, FacialTellingState]
-        for state in self.graph.stream(initial_state):
+        async for state in self.graph.astream(initial_state):
             for node_id, state_value in state.items():
                 yield (node_id, state_value)
@@ -1,18 +1,44 @@
 import asyncio
+from concurrent.futures import ThreadPoolExecutor
 from io import BytesIO
+from typing import ClassVar
 
 from discord.ext.commands import Context, command
 from telegram import Update
 from telegram.ext import ContextTypes, MessageHandler, filters
 
 from app.core.chat_model import ChatModelService
-from app.utils.image import ImageBytesToB64
-from app.facial.facial_graph import FacialGraphService
+from app.core.database import MongoDBService
+from app.core.settings import Settings
+from app.utils.image import FaceCheck, ImagePreprocessor, PreparedImage, select_photo_size
+from app.facial.facial_cache import FacialReadingCache
+from app.facial.facial_graph import FacialGraphMode, FacialGraphService
 
 
 class FacialHandler:
-    def __init__(self, chat_model_service: ChatModelService):
-        self.facial_graph_service = FacialGraphService(chat_model_service)
+    face_check_messages: ClassVar[dict[FaceCheck, str]] = {
+        FaceCheck.no_face: "Xin lỗi, tôi không tìm thấy khuôn mặt nào trong ảnh này.",
+        FaceCheck.multiple_faces: "Xin lỗi, ảnh có nhiều khuôn mặt, vui lòng gửi ảnh chỉ có một người.",
+        FaceCheck.blurry: "Xin lỗi, ảnh quá mờ, vui lòng gửi ảnh rõ nét hơn.",
+    }
+
+    def __init__(self, chat_model_service: ChatModelService, mongodb_service: MongoDBService, settings: Settings):
+        self.facial_graph_service = FacialGraphService(
+            chat_model_service,
+            mode=FacialGraphMode(settings.facial_graph_mode),
+            facial_reading_cache=FacialReadingCache(mongodb_service),
+        )
+        self.photo_min_edge = settings.facial_photo_min_edge
+        self.image_preprocessor = ImagePreprocessor(
+            max_edge=settings.facial_image_max_edge,
+            format_=settings.facial_image_format,
+            quality=settings.facial_image_quality,
+            min_sharpness=settings.facial_image_min_sharpness,
+        )
+        self.executor = ThreadPoolExecutor(max_workers=settings.facial_image_max_workers, thread_name_prefix="facial-image")
+
+    async def prepare_image(self, image_bytes: BytesIO) -> PreparedImage:
+        return await asyncio.get_running_loop().run_in_executor(self.executor, self.image_preprocessor.prepare, image_bytes)
 
     @classmethod
     def syntax(cls):
@@ -25,19 +51,21 @@ class FacialHandler:
             if not update.message.photo:
                 await update.message.reply_text("Empty Query")
                 return
-            photo = update.message.photo[-1]
+            photo = select_photo_size(update.message.photo, self.photo_min_edge)
 
             file_ = await photo.get_file()
-            image_bytes = await file_.download_as_bytearray()
-            image_url = ImageBytesToB64().dump(image_bytes)
+            with BytesIO() as buffer:
+                await file_.download_to_memory(buffer)
+                buffer.seek(0)
+                prepared_image = await self.prepare_image(buffer)
+            if prepared_image.face_check != FaceCheck.ok:
+                await update.message.reply_text(self.face_check_messages[prepared_image.face_check])
+                return
 
-            for _, state in self.facial_graph_service.run(image_url):
-                bot_messages = state.get("bot_messages", [])
-                if not bot_messages:
-                    continue
-                bot_message = bot_messages[-1]
-                await bot_message.reply_telegram(update)
-                await asyncio.sleep(0.25)
+            async for _, state in self.facial_graph_service.run(prepared_image.image_url, prepared_image.image_hash):
+                for bot_message in state.get("bot_messages", []):
+                    await bot_message.reply_telegram(update)
+                    await asyncio.sleep(0.25)
 
         _filters = filters.PHOTO & filters.CaptionRegex(f"^/{self.syntax()[0]}")
         return MessageHandler(_filters, handler)
@@ -53,16 +81,15 @@ class FacialHandler:
             attachment = attachments[0]
             with BytesIO() as buffer:
                 await attachment.save(buffer)
-                image_url = ImageBytesToB64().dump(buffer.getvalue())
+                prepared_image = await self.prepare_image(buffer)
+            if prepared_image.face_check != FaceCheck.ok:
+                await ctx.send(self.face_check_messages[prepared_image.face_check])
+                return
 
             await ctx.send("⏳ Đang luận giải...")
-            for _, state in self.facial_graph_service.run(image_url):
-                bot_messages = state.get("bot_messages", [])
-                if not bot_messages:
-                    continue
-
-                bot_message = bot_messages[-1]
-                await bot_message.reply_discord(ctx)
-                await asyncio.sleep(0.25)
+            async for _, state in self.facial_graph_service.run(prepared_image.image_url, prepared_image.image_hash):
+                for bot_message in state.get("bot_messages", []):
+                    await bot_message.reply_discord(ctx)
+                    await asyncio.sleep(0.25)
 
         return handler
@@ -25,3 +25,8 @@ class FacialAnalysis(BaseModel):
     love_life: Annotated[str, Field(description="Analyzed Love Life")]
     health: Annotated[str, Field(description="Analyzed Health")]
     summary: Annotated[str, Field(description="Analyzed Summary")]
+
+
+class FacialReading(BaseModel):
+    features: Annotated[FacialFeatures, Field(description="The portrait's facial features")]
+    analysis: Annotated[FacialAnalysis, Field(description="Physiognomy analysis of the facial features")]
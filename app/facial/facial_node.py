@@ -5,10 +5,48 @@ from langchain_core.prompts import ChatPromptTemplate, HumanMessagePromptTemplat
 
 from app.bot.message import TextMessage
 from app.core.chat_model import ChatModelNode
-from app.facial.facial_model import FacialFeatures
+from app.facial.facial_cache import FacialReadingCache, FacialReadingEntry
+from app.facial.facial_model import FacialFeatures, FacialReading
 from app.facial.facial_state import FacialTellingState
 
 
+class LookupFacialReading:
+    facial_reading_cache: FacialReadingCache
+
+    def __init__(self, facial_reading_cache: FacialReadingCache):
+        self.facial_reading_cache = facial_reading_cache
+
+    def __call__(self, state: FacialTellingState):
+        if state.get("image_hash") is None:
+            return FacialTellingState()
+        entry = self.facial_reading_cache.get(state["image_hash"])
+        if not entry:
+            return FacialTellingState()
+        return FacialTellingState(
+            facial_features=entry.features,
+            messages=[AIMessage(content=entry.analysis)],
+            bot_messages=[TextMessage(entry.features.model_dump_json()), TextMessage(entry.analysis)],
+        )
+
+
+class ValidateFacialReadingCached:
+    def __call__(self, state: FacialTellingState):
+        return "facial_features" in state
+
+
+class StoreFacialReading:
+    facial_reading_cache: FacialReadingCache
+
+    def __init__(self, facial_reading_cache: FacialReadingCache):
+        self.facial_reading_cache = facial_reading_cache
+
+    def __call__(self, state: FacialTellingState):
+        if state.get("image_hash") is not None:
+            entry = FacialReadingEntry(state["facial_features"], state["messages"][-1].content)
+            self.facial_reading_cache.set(state["image_hash"], entry)
+        return FacialTellingState()
+
+
 class ExtractFacialFeatures(ChatModelNode):
     system_message = SystemMessage(
         content=dedent("""
@@ -32,7 +70,7 @@ class ExtractFacialFeatures(ChatModelNode):
     prompt = ChatPromptTemplate.from_messages([system_message, human_message])
 
     def __call__(self, state: FacialTellingState):
-        chain = self.prompt | self.chat_model_service.chat_model.with_structured_output(FacialFeatures)
+        chain = self.limit(self.prompt | self.chat_model_service.chat_model.with_structured_output(FacialFeatures))
         facial_features: FacialFeatures = chain.invoke({"image": state["image_url"]})
         return FacialTellingState(facial_features=facial_features)
 
@@ -74,6 +112,49 @@ class AnalyzeFacialFeatures(ChatModelNode):
     prompt = ChatPromptTemplate.from_messages([system_message, human_message])
 
     def __call__(self, state: FacialTellingState):
-        chain = self.prompt | self.chat_model_service.chat_model
+        chain = self.limit(self.prompt | self.chat_model_service.chat_model)
         analysis: AIMessage = chain.invoke({"input": state["facial_features"].model_dump_json(indent=2)})
         return FacialTellingState(messages=[analysis], bot_messages=[TextMessage(analysis.content)])
+
+
+class ReadFacialFeatures(ChatModelNode):
+    system_message = SystemMessage(
+        content=dedent(
+            """
+            Bạn là chuyên gia tướng học Việt Nam, am hiểu nhân tướng học Á Đông.
+            Trước tiên, hãy quan sát ảnh khuôn mặt người và mô tả chi tiết các đặc điểm vật lý mà bạn nhìn thấy, ở mức mô tả trung lập, không phán đoán hay diễn giải.
+            Nếu ảnh bị mờ hoặc không đủ thông tin, hãy trả về lỗi.
+            Sau đó, dựa vào các đặc điểm đó để phân tích ý nghĩa tướng học tổng thể, bao gồm:
+            - Tính cách
+            - Công danh, sự nghiệp
+            - Tình duyên
+            - Sức khỏe
+            - Vận mệnh chung (ngắn hạn và dài hạn)
+
+            Hãy viết bài phân tích chi tiết, giàu nội dung, tự nhiên, và mang phong cách của người xem tướng — có thể sử dụng văn phong tướng số Việt Nam.
+            Toàn bộ bài phân tích dưới 2000 ký tự
+            """
+        )
+    )
+    human_message = ExtractFacialFeatures.human_message
+    prompt = ChatPromptTemplate.from_messages([system_message, human_message])
+
+    def __call__(self, state: FacialTellingState):
+        chain = self.limit(self.prompt | self.chat_model_service.chat_model.with_structured_output(FacialReading))
+        reading: FacialReading = chain.invoke({"image": state["image_url"]})
+        return FacialTellingState(facial_features=reading.features, facial_analysis=reading.analysis)
+
+
+class DumpFacialAnalysis:
+    def __call__(self, state: FacialTellingState):
+        analysis = state["facial_analysis"]
+        content = "\n\n".join(
+            [
+                f"Tính cách: {analysis.personality}",
+                f"Công danh, sự nghiệp: {analysis.career_fortune}",
+                f"Tình duyên: {analysis.love_life}",
+                f"Sức khỏe: {analysis.health}",
+                f"Tổng kết: {analysis.summary}",
+            ]
+        )
+        return FacialTellingState(messages=[AIMessage(content=content)], bot_messages=[TextMessage(content)])
@@ -1,7 +1,10 @@
 from app.core.state import BotMessagesState
-from app.facial.facial_model import FacialFeatures
+from app.facial.facial_model import FacialAnalysis, FacialFeatures
+from app.utils.image import FaceHash
 
 
 class FacialTellingState(BotMessagesState):
     image_url: str
+    image_hash: FaceHash | None
     facial_features: FacialFeatures
+    facial_analysis: FacialAnalysis
@@ -1,10 +1,18 @@
+from io import BytesIO
 from pathlib import Path
+from types import SimpleNamespace
 
 import pytest
+from PIL import Image, ImageFilter
+from langchain_core.messages import AIMessage
 
 from app.core.chat_model import ChatModelService
-from app.facial.facial_graph import FacialGraphService
-from app.utils.image import ImageBytesToB64
+from app.core.database import MongoDBService
+from app.facial.facial_cache import FacialReadingCache, FacialReadingEntry
+from app.facial.facial_graph import FacialGraphMode, FacialGraphService
+from app.facial.facial_model import FacialAnalysis, FacialFeatures, FacialReading
+from app.facial.facial_node import LookupFacialReading, StoreFacialReading
+from app.utils.image import FaceCheck, FaceHash, ImagePreprocessor, dhash, detect_faces, load_image, select_photo_size
 
 
 class TestFacial:
@@ -13,13 +21,126 @@ class TestFacial:
         return FacialGraphService(chat_model_service)
 
     @pytest.fixture
-    def image_url(self):
-        path = Path(__file__).parent / "facial_test.png"
-        with path.open("rb") as f:
-            image_bytes = f.read()
-            return ImageBytesToB64().dump(image_bytes)
-
-    def test_graph(self, facial_graph_service: FacialGraphService, image_url: str):
-        for node, state in facial_graph_service.run(image_url):
+    def facial_reading_cache(self, mongodb_service: MongoDBService):
+        return FacialReadingCache(mongodb_service)
+
+    @pytest.fixture
+    def facial_features(self):
+        return FacialFeatures(**{field: field for field in FacialFeatures.model_fields if field != "error"})
+
+    @pytest.fixture
+    def image_bytes(self):
+        return (Path(__file__).parent / "facial_test.png").read_bytes()
+
+    @pytest.fixture
+    def image_url(self, image_bytes: bytes):
+        return ImagePreprocessor().dump(image_bytes)
+
+    def test_graph(self, facial_graph_service: FacialGraphService, image_url: str, run_graph):
+        for node, state in run_graph(facial_graph_service.run(image_url)):
             print(f">>> {node}")
             print(state)
+
+    def test_graph_single(self, chat_model_service: ChatModelService, image_url: str, run_graph):
+        facial_graph_service = FacialGraphService(chat_model_service, mode=FacialGraphMode.single)
+        for node, state in run_graph(facial_graph_service.run(image_url)):
+            print(f">>> {node}")
+            print(state)
+
+    def test_read_single(self, image_url: str, facial_features: FacialFeatures, fake_chat_model_service, run_graph):
+        prompts = []
+        features = facial_features
+        analysis = FacialAnalysis(**{field: field for field in FacialAnalysis.model_fields})
+
+        def read(prompt):
+            prompts.append(prompt.to_messages())
+            return FacialReading(features=features, analysis=analysis)
+
+        facial_graph_service = FacialGraphService(fake_chat_model_service(structured_output=read), mode=FacialGraphMode.single)
+        updates = run_graph(facial_graph_service.run(image_url))
+        bot_messages = [bot_message for _, state in updates for bot_message in state.get("bot_messages", [])]
+
+        assert len(prompts) == 1 and prompts[0][-1].content[1]["image_url"]["url"] == image_url
+        assert bot_messages[0].text == features.model_dump_json()
+        assert bot_messages[1].text.startswith("Tính cách: personality\n\n") and bot_messages[1].text.endswith("Tổng kết: summary")
+
+    def test_preprocess_image(self, image_bytes: bytes):
+        assert len(detect_faces(load_image(image_bytes))) == 1
+
+        image_preprocessor = ImagePreprocessor(max_edge=256)
+        processed = image_preprocessor.process(image_bytes)
+        image = Image.open(BytesIO(processed))
+        assert image.format == "JPEG" and max(image.size) <= 256
+        assert len(processed) < len(image_bytes) / 4
+        assert image_preprocessor.dump(image_bytes).startswith("data:image/jpeg;base64,")
+
+        image = Image.open(BytesIO(ImagePreprocessor(format_="webp").process(image_bytes)))
+        assert image.format == "WEBP" and max(image.size) <= 768
+
+    def test_select_photo_size(self):
+        photo_sizes = [
+            SimpleNamespace(width=width, height=height, file_size=width * height // 8)
+            for width, height in [(90, 68), (320, 240), (800, 600), (1280, 960)]
+        ]
+        assert select_photo_size(photo_sizes, 600) is photo_sizes[2]
+        assert select_photo_size(photo_sizes[::-1], 240) is photo_sizes[1]
+        assert select_photo_size(photo_sizes, 2000) is photo_sizes[-1]
+
+    def test_dhash(self, image_bytes: bytes):
+        image = load_image(image_bytes)
+        with BytesIO() as buffer:
+            image.resize((image.width // 2, image.height // 2)).save(buffer, format="JPEG", quality=50)
+            recompressed = load_image(buffer.getvalue())
+        assert (dhash(image) ^ dhash(recompressed)).bit_count() <= 2
+        assert (dhash(image) ^ dhash(image.transpose(Image.Transpose.FLIP_LEFT_RIGHT))).bit_count() > 16
+
+    def test_graph_cached(self, image_bytes: bytes, facial_features: FacialFeatures, fake_chat_model_service, run_graph):
+        entries = {}
+        facial_reading_cache = SimpleNamespace(get=entries.get, set=entries.__setitem__)
+        chat_model_service = fake_chat_model_service(lambda _: AIMessage(content="analysis"), lambda _: facial_features)
+        facial_graph_service = FacialGraphService(chat_model_service, facial_reading_cache=facial_reading_cache)
+
+        _, image_url, image_hash = ImagePreprocessor().prepare(image_bytes)
+        assert [node for node, _ in run_graph(facial_graph_service.run(image_url, image_hash))][-1] == StoreFacialReading.__name__
+        assert entries == {image_hash: FacialReadingEntry(facial_features, "analysis")}
+
+        chat_model_service.chat_model.structured_output = None
+        updates = run_graph(facial_graph_service.run(image_url, image_hash))
+        assert [node for node, _ in updates] == [LookupFacialReading.__name__]
+        assert [bot_message.text for bot_message in updates[0][1]["bot_messages"]] == [facial_features.model_dump_json(), "analysis"]
+
+    def test_face_hash(self, image_bytes: bytes):
+        image_preprocessor = ImagePreprocessor()
+        image = load_image(image_bytes)
+        image_hash = image_preprocessor.prepare(image_bytes).image_hash
+        for variant in [image.resize((image.width // 2, image.height // 2)), image.crop((10, 5, image.width - 10, image.height))]:
+            with BytesIO() as buffer:
+                variant.save(buffer, format="JPEG", quality=70)
+                variant_hash = image_preprocessor.prepare(buffer.getvalue()).image_hash
+            assert (image_hash.coarse ^ variant_hash.coarse).bit_count() <= 4
+            assert (image_hash.fine ^ variant_hash.fine).bit_count() <= 32
+
+    def test_reading_cache(self, facial_reading_cache: FacialReadingCache, facial_features: FacialFeatures):
+        fine = int("0F" * 32, 16)
+        facial_reading_cache.set(FaceHash(0x0F0F_0F0F_0F0F_0F0F, fine), FacialReadingEntry(facial_features, "analysis"))
+        assert facial_reading_cache.get(FaceHash(0x0F0F_0F0F_0F0F_0F0E, fine ^ 0xFF)) == FacialReadingEntry(facial_features, "analysis")
+        assert facial_reading_cache.get(FaceHash(0x0F0F_0F0F_0F0F_0F0F, ~fine & (1 << 256) - 1)) is None
+        assert facial_reading_cache.get(FaceHash(0xF0F0_F0F0_F0F0_F0F0, fine)) is None
+        assert facial_reading_cache.stats()["hits"] == 1 and facial_reading_cache.stats()["rejections"] == 1
+
+    def test_prepare_face_check(self, image_bytes: bytes):
+        image_preprocessor = ImagePreprocessor()
+        assert image_preprocessor.prepare(image_bytes).face_check == FaceCheck.ok
+
+        image = load_image(image_bytes)
+        rejected = {
+            FaceCheck.no_face: image.crop((0, 150, 150, 315)),
+            FaceCheck.multiple_faces: Image.new("RGB", (image.width, image.height * 2)),
+            FaceCheck.blurry: image.filter(ImageFilter.GaussianBlur(2)),
+        }
+        rejected[FaceCheck.multiple_faces].paste(image, (0, 0))
+        rejected[FaceCheck.multiple_faces].paste(image, (0, image.height))
+        for face_check, rejected_image in rejected.items():
+            with BytesIO() as buffer:
+                rejected_image.save(buffer, format="PNG")
+                assert image_preprocessor.prepare(buffer.getvalue()) == (face_check, None, None)
@@ -1,8 +1,9 @@
+import random
 from enum import Enum
 from io import BytesIO
 from pathlib import Path
 
-from PIL import Image
+from app.tarot.tarot_pack import encode_tarot_card_image, fingerprint_tarot_deck, load_tarot_pack
 
 
 class TarotCardType(str, Enum):
@@ -10,41 +11,92 @@ class TarotCardType(str, Enum):
     minor = "minor"
 
 
-class TarotCardVariant:
-    parent: "TarotCard"
-    is_reversed: bool
-    meaning: str
-    image: BytesIO
-
-    def __init__(self, parent: "TarotCard", is_reversed: bool, meaning: str, image_dir: str = "static"):
-        self.parent = parent
-        self.is_reversed = is_reversed
-        self.meaning = meaning
-
-        image = Image.open(Path(__file__).parent / image_dir / self.parent.image_path)
-        image.load()
-        buffer = BytesIO()
-        image.rotate(180 * int(self.is_reversed)).save(buffer, format="PNG")
-        buffer.seek(0)
-        self.image = buffer
-
-
 class TarotCard:
+    __slots__ = ("name", "type_", "image_path", "meanings")
+
     name: str
     type_: TarotCardType
-    image_path: str
-    variants: tuple[TarotCardVariant, TarotCardVariant]
+    image_path: Path
+    meanings: tuple[str, str]
 
-    def __init__(self, name: str, type_: TarotCardType, image_path: str, meanings: tuple[str, str]):
+    def __init__(self, name: str, type_: TarotCardType, image_path: str, meanings: tuple[str, str], image_dir: str = "static"):
         self.name = name
         self.type_ = type_
-        self.image_path = image_path
+        self.image_path = Path(__file__).parent / image_dir / image_path
         self.meanings = meanings
 
-        normal_meaning, reversed_meaning = meanings
-        normal_variant = TarotCardVariant(self, False, normal_meaning)
-        reversed_variant = TarotCardVariant(self, True, reversed_meaning)
-        self.variants = (normal_variant, reversed_variant)
+
+class TarotCardVariant:
+    __slots__ = ("deck", "id")
+
+    deck: "TarotDeck"
+    id: int
+
+    def __init__(self, deck: "TarotDeck", id: int):
+        self.deck = deck
+        self.id = id
+
+    @property
+    def name(self) -> str:
+        return self.deck.names[self.id >> 1]
+
+    @property
+    def is_reversed(self) -> bool:
+        return bool(self.id & 1)
+
+    @property
+    def meaning(self) -> str:
+        return self.deck.meanings[self.id]
+
+    @property
+    def image_path(self) -> Path:
+        return self.deck.image_paths[self.id >> 1]
+
+    @property
+    def key(self) -> str:
+        return f"{self.image_path.stem}:{int(self.is_reversed)}"
+
+    @property
+    def image_bytes(self) -> memoryview | bytes:
+        tarot_pack = load_tarot_pack(self.deck.fingerprint)
+        if tarot_pack is not None:
+            return tarot_pack[self.id]
+        return encode_tarot_card_image(self.image_path, self.is_reversed)
+
+    @property
+    def image(self) -> BytesIO:
+        return BytesIO(self.image_bytes)
+
+
+class TarotDeck:
+    # Variant ids are card_index * 2 + is_reversed
+    __slots__ = ("names", "types", "image_paths", "meanings")
+
+    names: tuple[str, ...]
+    types: tuple[TarotCardType, ...]
+    image_paths: tuple[Path, ...]
+    meanings: tuple[str, ...]
+
+    def __init__(self, tarot_cards: list[TarotCard]):
+        self.names = tuple(tarot_card.name for tarot_card in tarot_cards)
+        self.types = tuple(tarot_card.type_ for tarot_card in tarot_cards)
+        self.image_paths = tuple(tarot_card.image_path for tarot_card in tarot_cards)
+        self.meanings = tuple(meaning for tarot_card in tarot_cards for meaning in tarot_card.meanings)
+
+    def __len__(self):
+        return len(self.meanings)
+
+    @property
+    def fingerprint(self) -> str:
+        return fingerprint_tarot_deck(self.names, self.image_paths)
+
+    def __getitem__(self, id: int) -> TarotCardVariant:
+        if not 0 <= id < len(self):
+            raise IndexError(id)
+        return TarotCardVariant(self, id)
+
+    def draw(self, count: int) -> list[int]:
+        return [2 * i + random.getrandbits(1) for i in random.sample(range(len(self.names)), count)]
 
 
 tarot_cards = [
@@ -755,3 +807,5 @@ tarot_cards = [
         ),
     ),
 ]
+
+tarot_deck = TarotDeck(tarot_cards)
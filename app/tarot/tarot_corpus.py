@@ -0,0 +1,196 @@
+import hashlib
+import json
+import re
+import unicodedata
+from functools import lru_cache
+from pathlib import Path
+from textwrap import dedent
+
+from langchain_core.messages import AIMessage, SystemMessage
+from langchain_core.prompts import ChatPromptTemplate, HumanMessagePromptTemplate
+
+from app.core.chat_model import ChatModelService
+from app.core.logger import get_logger
+from app.tarot.tarot_card_model import TarotDeck
+
+logger = get_logger(__name__)
+
+TAROT_CORPUS_PATH = Path(__file__).parent / "static" / "tarot_corpus.json"
+
+tarot_question_categories = {
+    "chung": [],
+    "tình yêu": [
+        "yêu",
+        "tình yêu",
+        "tình cảm",
+        "người yêu",
+        "người ấy",
+        "anh ấy",
+        "cô ấy",
+        "crush",
+        "hôn nhân",
+        "kết hôn",
+        "cưới",
+        "vợ chồng",
+        "bạn trai",
+        "bạn gái",
+        "chia tay",
+        "tình duyên",
+        "tiến tới",
+    ],
+    "công việc": [
+        "công việc",
+        "sự nghiệp",
+        "công ty",
+        "việc làm",
+        "đi làm",
+        "nghỉ việc",
+        "thăng chức",
+        "thăng tiến",
+        "lên chức",
+        "trưởng phòng",
+        "phỏng vấn",
+        "sếp",
+        "đồng nghiệp",
+        "nghề nghiệp",
+        "kinh doanh",
+    ],
+    "tài chính": [
+        "tiền",
+        "tiền bạc",
+        "kiếm tiền",
+        "tài chính",
+        "đầu tư",
+        "chứng khoán",
+        "cổ phiếu",
+        "lương",
+        "tăng lương",
+        "thu nhập",
+        "nợ",
+        "nợ nần",
+        "tiết kiệm",
+    ],
+    "sức khỏe": ["sức khỏe", "sức khoẻ", "bệnh", "ốm", "ốm đau", "tập luyện", "ăn uống", "giảm cân"],
+    "học tập": ["học", "học tập", "kỳ thi", "đi thi", "thi cử", "trường", "đại học", "bằng cấp", "du học"],
+}
+
+
+def normalize_question(question: str) -> str:
+    question = unicodedata.normalize("NFC", question.lower())
+    return " ".join(re.sub(r"[^\w]+", " ", question).split())
+
+
+def fold_diacritics(text: str) -> str:
+    text = unicodedata.normalize("NFD", text.replace("đ", "d"))
+    return "".join(c for c in text if unicodedata.category(c) != "Mn")
+
+
+def classify_tarot_question(question: str) -> str:
+    words = f" {normalize_question(question)} "
+    folded_words = fold_diacritics(words)
+    scores = {}
+    for category, keywords in tarot_question_categories.items():
+        # Single words are only matched with their accents, unaccented "yeu" or "tien" would also match "yếu" or "tiến"
+        scores[category] = sum(
+            f" {keyword} " in words or " " in keyword and f" {fold_diacritics(keyword)} " in folded_words for keyword in keywords
+        )
+    best = max(scores.values())
+    categories = [category for category, score in scores.items() if score == best]
+    return categories[0] if best and len(categories) == 1 else "chung"
+
+
+class TarotCorpus:
+    categories: list[str]
+    interpretations: list[str]
+    fingerprint: str
+
+    def __init__(self, categories: list[str], interpretations: list[str], fingerprint: str):
+        self.categories = categories
+        self.category_indexes = {category: i for i, category in enumerate(categories)}
+        self.interpretations = interpretations
+        self.fingerprint = fingerprint
+
+    def get(self, tarot_card_id: int, category: str) -> str | None:
+        if category not in self.category_indexes:
+            return None
+        i = tarot_card_id * len(self.categories) + self.category_indexes[category]
+        return self.interpretations[i] if i < len(self.interpretations) else None
+
+    def dump(self, path: Path = TAROT_CORPUS_PATH):
+        with path.open("w") as f:
+            json.dump(
+                {"categories": self.categories, "interpretations": self.interpretations, "fingerprint": self.fingerprint},
+                f,
+                ensure_ascii=False,
+            )
+
+
+@lru_cache(1)
+def load_tarot_corpus(fingerprint: str, path: Path = TAROT_CORPUS_PATH) -> TarotCorpus:
+    if not path.exists():
+        raise FileNotFoundError(f"Tarot corpus not found at {path}, build it with python -m app.tarot.tarot_corpus")
+    with path.open() as f:
+        tarot_corpus = TarotCorpus(**json.load(f))
+    if tarot_corpus.fingerprint != fingerprint:
+        raise ValueError(f"Tarot corpus at {path} was built from another deck or prompt, rebuild it with python -m app.tarot.tarot_corpus")
+    return tarot_corpus
+
+
+class TarotCorpusBuilder:
+    system_message = SystemMessage(
+        content=dedent(
+            """
+            Bạn là một nhà chiêm tinh và chuyên gia Tarot. Hãy phân tích ý nghĩa của lá Tarot sau trong chủ đề được yêu cầu.
+            Phân tích cần áp dụng được cho nhiều câu hỏi khác nhau trong cùng chủ đề.
+            Chỉ trả về phần phân tích, ngoài ra không đưa ra thông tin gì thêm
+            """
+        )
+    )
+    human_message = HumanMessagePromptTemplate.from_template(
+        dedent(
+            """
+            Chủ đề: {category}
+            Lá Tarot: {tarot_card_name}
+            Đảo ngược: {tarot_card_is_reversed}
+            Ý nghĩa: {tarot_card_meaning}
+            """
+        )
+    )
+    prompt = ChatPromptTemplate.from_messages([system_message, human_message])
+
+    def __init__(self, chat_model_service: ChatModelService, max_concurrency: int = 8):
+        self.chain = self.prompt | chat_model_service.chat_model
+        self.max_concurrency = max_concurrency
+
+    def build(self, tarot_deck: TarotDeck) -> TarotCorpus:
+        categories = list(tarot_question_categories)
+        inputs = [
+            {
+                "category": category,
+                "tarot_card_name": tarot_deck[tarot_card_id].name,
+                "tarot_card_is_reversed": tarot_deck[tarot_card_id].is_reversed,
+                "tarot_card_meaning": tarot_deck[tarot_card_id].meaning,
+            }
+            for tarot_card_id in range(len(tarot_deck))
+            for category in categories
+        ]
+        messages: list[AIMessage] = self.chain.batch(inputs, {"max_concurrency": self.max_concurrency})
+        return TarotCorpus(categories, [message.content for message in messages], fingerprint_tarot_corpus(tarot_deck))
+
+
+@lru_cache(maxsize=4)
+def fingerprint_tarot_corpus(tarot_deck: TarotDeck) -> str:
+    # Interpretations depend on the deck, the categories and the prompt, a change to any of them makes the corpus stale
+    digest = hashlib.sha256(tarot_deck.fingerprint.encode())
+    for text in [*tarot_question_categories, TarotCorpusBuilder.system_message.content, TarotCorpusBuilder.human_message.prompt.template]:
+        digest.update(f"{text}\0".encode())
+    return digest.hexdigest()
+
+
+if __name__ == "__main__":
+    from app.core.settings import Settings
+    from app.tarot.tarot_card_model import tarot_deck
+
+    tarot_corpus = TarotCorpusBuilder(ChatModelService(Settings())).build(tarot_deck)
+    tarot_corpus.dump()
+    logger.info(f"Tarot corpus written to {TAROT_CORPUS_PATH}")
@@ -1,33 +1,84 @@
+from enum import Enum
+from uuid import uuid4
+
 from langchain_core.messages import HumanMessage
+from langgraph.checkpoint.base import BaseCheckpointSaver
 from langgraph.graph import StateGraph, START, END
 
-from app.core.chat_model import ChatModelService
+from app.core.chat_model import ChatModelService, chat_model_retry_policy
+from app.tarot.tarot_card_model import tarot_deck
+from app.tarot.tarot_corpus import fingerprint_tarot_corpus, load_tarot_corpus
 from app.tarot.tarot_state import TarotTellingState
-from app.tarot.tarot_node import RandomizeTarotCards, MapAnalyzeTarotCards, AnalyzeTarotCard, SummarizeTarotCards
+from app.tarot.tarot_node import (
+    RandomizeTarotCards,
+    MapAnalyzeTarotCards,
+    AnalyzeTarotCard,
+    LookupTarotCardInterpretation,
+    SummarizeTarotCards,
+    ReadTarotCards,
+)
+from app.tarot.tarot_spread import TarotSpread, three_card_spread
+
+
+class TarotGraphMode(str, Enum):
+    fanout = "fanout"
+    single = "single"
+    corpus = "corpus"
 
 
 class TarotGraphService:
-    def __init__(self, chat_model_service: ChatModelService):
+    def __init__(
+        self,
+        chat_model_service: ChatModelService,
+        spread: TarotSpread = three_card_spread,
+        composite: bool = True,
+        mode: TarotGraphMode = TarotGraphMode.fanout,
+        max_concurrency: int = 3,
+        checkpointer: BaseCheckpointSaver | None = None,
+    ):
+        self.spread = spread
+        self.max_concurrency = max_concurrency
         workflow = StateGraph(TarotTellingState)
 
-        workflow.add_node(RandomizeTarotCards.__name__, RandomizeTarotCards())
-        workflow.add_node(AnalyzeTarotCard.__name__, AnalyzeTarotCard(chat_model_service))
-        workflow.add_node(SummarizeTarotCards.__name__, SummarizeTarotCards(chat_model_service))
-
+        workflow.add_node(RandomizeTarotCards.__name__, RandomizeTarotCards(composite))
         workflow.add_edge(START, RandomizeTarotCards.__name__)
-        workflow.add_conditional_edges(
-            RandomizeTarotCards.__name__,
-            MapAnalyzeTarotCards(AnalyzeTarotCard.__name__),
-            [AnalyzeTarotCard.__name__],
-        )
-        workflow.add_edge(AnalyzeTarotCard.__name__, SummarizeTarotCards.__name__)
-        workflow.add_edge(SummarizeTarotCards.__name__, END)
-
-        self.graph = workflow.compile()
-
-    def run(self, question: str):
-        initial_state = TarotTellingState(messages=[HumanMessage(content=question)])
+
+        if mode == TarotGraphMode.single:
+            workflow.add_node(ReadTarotCards.__name__, ReadTarotCards(chat_model_service), retry_policy=chat_model_retry_policy)
+            workflow.add_edge(RandomizeTarotCards.__name__, ReadTarotCards.__name__)
+            workflow.add_edge(ReadTarotCards.__name__, END)
+        else:
+            if mode == TarotGraphMode.corpus:
+                # Fail at startup rather than silently analyzing every card live
+                load_tarot_corpus(fingerprint_tarot_corpus(tarot_deck))
+            analyze_tarot_card = LookupTarotCardInterpretation if mode == TarotGraphMode.corpus else AnalyzeTarotCard
+            workflow.add_node(AnalyzeTarotCard.__name__, analyze_tarot_card(chat_model_service), retry_policy=chat_model_retry_policy)
+            workflow.add_node(SummarizeTarotCards.__name__, SummarizeTarotCards(chat_model_service), retry_policy=chat_model_retry_policy)
+            workflow.add_conditional_edges(
+                RandomizeTarotCards.__name__,
+                MapAnalyzeTarotCards(AnalyzeTarotCard.__name__),
+                [AnalyzeTarotCard.__name__],
+            )
+            workflow.add_edge(AnalyzeTarotCard.__name__, SummarizeTarotCards.__name__)
+            workflow.add_edge(SummarizeTarotCards.__name__, END)
+
+        self.checkpointer = checkpointer
+        self.graph = workflow.compile(checkpointer=checkpointer)
+
+    async def run(self, question: str, spread: TarotSpread | None = None, thread_id: str | None = None):
+        config = {"max_concurrency": self.max_concurrency, "configurable": {"thread_id": thread_id or uuid4().hex}}
+        initial_state = TarotTellingState(messages=[HumanMessage(content=question)], spread=(spread or self.spread).name)
+        if self.checkpointer:
+            # An interrupted run of the same thread resumes after its last completed superstep, with the same cards
+            if (await self.graph.aget_state(config)).next:
+                initial_state = None
+            else:
+                await self.checkpointer.adelete_thread(config["configurable"]["thread_id"])
+
         state: dict[str, TarotTellingState]
-        for state in self.graph.stream(initial_state):
+        async for state in self.graph.astream(initial_state, config):
             for node_id, state_value in state.items():
                 yield (node_id, state_value)
+
+        if self.checkpointer:
+            await self.checkpointer.adelete_thread(config["configurable"]["thread_id"])
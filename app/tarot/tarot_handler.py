@@ -4,13 +4,26 @@ from discord.ext.commands import Context, command
 from telegram import Update
 from telegram.ext import CommandHandler, ContextTypes
 
+from app.bot.file_reference import FileReferenceService
+from app.bot.message import ImageAlbumMessage
 from app.core.chat_model import ChatModelService
-from app.tarot.tarot_graph import TarotGraphService
+from app.core.checkpoint import MongoDBCheckpointSaver, checkpoint_thread_id
+from app.core.database import MongoDBService
+from app.core.settings import Settings
+from app.tarot.tarot_graph import TarotGraphMode, TarotGraphService
+from app.tarot.tarot_spread import parse_tarot_spread
 
 
 class TarotHandler:
-    def __init__(self, chat_model_service: ChatModelService):
-        self.tarot_graph_service = TarotGraphService(chat_model_service)
+    def __init__(self, chat_model_service: ChatModelService, mongodb_service: MongoDBService, settings: Settings):
+        self.tarot_graph_service = TarotGraphService(
+            chat_model_service,
+            composite=settings.tarot_composite,
+            mode=TarotGraphMode(settings.tarot_graph_mode),
+            max_concurrency=settings.tarot_max_concurrency,
+            checkpointer=MongoDBCheckpointSaver(mongodb_service),
+        )
+        self.file_reference_service = FileReferenceService(mongodb_service)
 
     @classmethod
     def syntax(cls):
@@ -20,37 +33,41 @@ class TarotHandler:
         async def handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
             if not update.message or not update.message.chat.id:
                 return
-            if not context.args:
+            spread, words = parse_tarot_spread(context.args or [])
+            if not words:
                 await update.message.reply_text("Empty Query")
                 return
 
-            question = " ".join(context.args)
-            for _, state in self.tarot_graph_service.run(question):
-                bot_messages = state.get("bot_messages", [])
-                if not bot_messages:
-                    continue
-                bot_message = bot_messages[-1]
-                await bot_message.reply_telegram(update)
-                await asyncio.sleep(0.25)
+            question = " ".join(words)
+            thread_id = checkpoint_thread_id(self.syntax()[0], update.message.chat.id, update.effective_user.id, spread.name, question)
+            async for _, state in self.tarot_graph_service.run(question, spread, thread_id):
+                for bot_message in state.get("bot_messages", []):
+                    if isinstance(bot_message, ImageAlbumMessage):
+                        await bot_message.reply_telegram(update, self.file_reference_service)
+                    else:
+                        await bot_message.reply_telegram(update)
+                    await asyncio.sleep(0.25)
 
         return CommandHandler(self.syntax()[0], handler)
 
     def discord_handler(self):
         @command(name=self.syntax()[0], help=self.syntax()[1])
         async def handler(ctx: Context, *, question: str):
-            if not question:
+            spread, words = parse_tarot_spread(question.split())
+            if not words:
                 await ctx.send("Empty Query")
                 return
 
             await ctx.send("⏳ Đang luận giải...")
 
-            for _, state in self.tarot_graph_service.run(question):
-                bot_messages = state.get("bot_messages", [])
-                if not bot_messages:
-                    continue
-
-                bot_message = bot_messages[-1]
-                await bot_message.reply_discord(ctx)
-                await asyncio.sleep(0.25)
+            question = " ".join(words)
+            thread_id = checkpoint_thread_id(self.syntax()[0], ctx.channel.id, ctx.author.id, spread.name, question)
+            async for _, state in self.tarot_graph_service.run(question, spread, thread_id):
+                for bot_message in state.get("bot_messages", []):
+                    if isinstance(bot_message, ImageAlbumMessage):
+                        await bot_message.reply_discord(ctx, self.file_reference_service)
+                    else:
+                        await bot_message.reply_discord(ctx)
+                    await asyncio.sleep(0.25)
 
         return handler
@@ -0,0 +1,14 @@
+from typing import Annotated
+
+from pydantic import BaseModel, Field
+
+
+class TarotCardAnalysis(BaseModel):
+    position: Annotated[str, Field(description="The card's position in the spread")]
+    card: Annotated[str, Field(description="The tarot card's name, and whether it is reversed")]
+    analysis: Annotated[str, Field(description="Analysis of the card for the user's question")]
+
+
+class TarotReading(BaseModel):
+    analyses: Annotated[list[TarotCardAnalysis], Field(description="One analysis per tarot card, in the order the cards were drawn")]
+    summary: Annotated[list[str], Field(description="Exactly 5 most notable points of the reading, in plain language")]
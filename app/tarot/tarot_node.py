@@ -1,29 +1,36 @@
-import random
+from io import BytesIO
 from textwrap import dedent
 
 from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
-from langchain_core.prompts import ChatPromptTemplate, HumanMessagePromptTemplate
+from langchain_core.prompts import ChatPromptTemplate, HumanMessagePromptTemplate, MessagesPlaceholder
 from langgraph.types import Send
 
-from app.bot.message import ImageAlbumMessage, TextMessage
-from app.core.chat_model import ChatModelNode
+from app.bot.message import ImageAlbumMessage, ImageMessage, TextMessage
+from app.core.chat_model import ChatModelNode, ChatModelService
 from app.tarot.tarot_state import TarotTellingState, TarotCardAnalyzeState
-from app.tarot.tarot_card_model import TarotCardVariant, tarot_cards
+from app.tarot.tarot_card_model import tarot_deck
+from app.tarot.tarot_corpus import classify_tarot_question, fingerprint_tarot_corpus, load_tarot_corpus
+from app.tarot.tarot_model import TarotReading
+from app.tarot.tarot_spread import render_tarot_spread, tarot_spreads
+from app.utils.token import TokenBudget
 
 
 class RandomizeTarotCards:
-    count: int
+    composite: bool
 
-    def __init__(self, count: int = 3):
-        self.count = count
+    def __init__(self, composite: bool = True):
+        self.composite = composite
 
-    def __call__(self, _: TarotTellingState):
-        tcs: list[TarotCardVariant] = []
-        for tarot_card in random.sample(tarot_cards, self.count):
-            tc = tarot_card.variants[random.choice([0, 1])]
-            tcs.append(tc)
-        bot_messages = [ImageAlbumMessage(images=[tc.image for tc in tcs])]
-        return TarotTellingState(tarot_cards=tcs, bot_messages=bot_messages)
+    def __call__(self, state: TarotTellingState):
+        spread = tarot_spreads[state["spread"]]
+        tarot_card_ids = tarot_deck.draw(spread.count)
+        if self.composite:
+            image = BytesIO(render_tarot_spread(spread, tuple(tarot_card_ids)))
+            bot_messages = [ImageMessage(image, filename="tarot_spread.jpg")]
+        else:
+            tcs = [tarot_deck[tarot_card_id] for tarot_card_id in tarot_card_ids]
+            bot_messages = [ImageAlbumMessage(images=[tc.image for tc in tcs], keys=[tc.key for tc in tcs])]
+        return TarotTellingState(tarot_card_ids=tarot_card_ids, bot_messages=bot_messages)
 
 
 class MapAnalyzeTarotCards:
@@ -34,7 +41,11 @@ class MapAnalyzeTarotCards:
 
     def __call__(self, state: TarotTellingState):
         question = state["messages"][0].content
-        return [Send(self.node_id, TarotCardAnalyzeState(question=question, tarot_card=tc)) for tc in state["tarot_cards"]]
+        spread = tarot_spreads[state["spread"]]
+        return [
+            Send(self.node_id, TarotCardAnalyzeState(question=question, position=slot.position, tarot_card_id=tarot_card_id))
+            for slot, tarot_card_id in zip(spread.slots, state["tarot_card_ids"])
+        ]
 
 
 class AnalyzeTarotCard(ChatModelNode):
@@ -44,6 +55,7 @@ class AnalyzeTarotCard(ChatModelNode):
             Bạn là một nhà chiêm tinh và chuyên gia Tarot. Sử dụng lá Tarot và câu hỏi của người dùng, hãy phân tích và đưa ra những nhận định.
             Ngoài ra không đưa ra thông tin gì thêm
             Đưa ra Kết quả phân tích theo định dạng
+            Vị trí: <vị trí>
             Lá bài: <lá bài>
             Phân tích: <phân tích>
             """
@@ -52,6 +64,7 @@ class AnalyzeTarotCard(ChatModelNode):
     tarot_human_message = HumanMessagePromptTemplate.from_template(
         dedent(
             """
+            Vị trí: {tarot_card_position}
             Lá Tarot: {tarot_card_name}
             Đảo ngược: {tarot_card_is_reversed}
             Ý nghĩa: {tarot_card_meaning}
@@ -63,18 +76,33 @@ class AnalyzeTarotCard(ChatModelNode):
     prompt = ChatPromptTemplate.from_messages(messages)
 
     def __call__(self, state: TarotCardAnalyzeState):
-        chain = self.prompt | self.chat_model_service.chat_model
+        tc = tarot_deck[state["tarot_card_id"]]
+        chain = self.limit(self.prompt | self.chat_model_service.chat_model)
         message: AIMessage = chain.invoke(
             {
                 "question": state["question"],
-                "tarot_card_name": state["tarot_card"].parent.name,
-                "tarot_card_is_reversed": state["tarot_card"].is_reversed,
-                "tarot_card_meaning": state["tarot_card"].meaning,
+                "tarot_card_position": state["position"],
+                "tarot_card_name": tc.name,
+                "tarot_card_is_reversed": tc.is_reversed,
+                "tarot_card_meaning": tc.meaning,
             }
         )
         return TarotTellingState(messages=[message], bot_messages=[TextMessage(message.content)])
 
 
+class LookupTarotCardInterpretation(AnalyzeTarotCard):
+    def __call__(self, state: TarotCardAnalyzeState):
+        tarot_corpus = load_tarot_corpus(fingerprint_tarot_corpus(tarot_deck))
+        interpretation = tarot_corpus.get(state["tarot_card_id"], classify_tarot_question(state["question"]))
+        if interpretation is None:
+            return super().__call__(state)
+
+        tc = tarot_deck[state["tarot_card_id"]]
+        name = f"{tc.name} (Đảo ngược)" if tc.is_reversed else tc.name
+        content = f"Vị trí: {state['position']}\nLá bài: {name}\nPhân tích: {interpretation}"
+        return TarotTellingState(messages=[AIMessage(content=content)], bot_messages=[TextMessage(content)])
+
+
 class SummarizeTarotCards(ChatModelNode):
     system_message = SystemMessage(
         content=dedent(
@@ -88,11 +116,54 @@ class SummarizeTarotCards(ChatModelNode):
         )
     )
     human_question_message = HumanMessagePromptTemplate.from_template("Câu hỏi: {question}")
-    messages = [system_message, human_question_message]
+    messages = (system_message, human_question_message, MessagesPlaceholder("analyses"))
+    prompt = ChatPromptTemplate.from_messages(messages)
+    token_budget = TokenBudget(max_tokens=6000)
+
+    def __init__(self, chat_model_service: ChatModelService):
+        super().__init__(chat_model_service)
+        self.chain = self.limit(self.prompt | self.chat_model_service.chat_model)
+
+    def __call__(self, state: TarotTellingState):
+        analyses = self.token_budget.fit([m.content for m in state["messages"] if isinstance(m, AIMessage)])
+        message: AIMessage = self.chain.invoke(
+            {
+                "question": state["messages"][0].content,
+                "analyses": [HumanMessage(content=analysis) for analysis in analyses],
+            }
+        )
+        return TarotTellingState(messages=[message], bot_messages=[TextMessage(message.content)])
+
+
+class ReadTarotCards(ChatModelNode):
+    system_message = SystemMessage(
+        content=dedent(
+            """
+            Bạn là một nhà chiêm tinh và chuyên gia Tarot. Sử dụng các lá Tarot và câu hỏi của người dùng, hãy phân tích và đưa ra những nhận định.
+            Phân tích từng lá Tarot theo đúng thứ tự được cung cấp, ngoài ra không đưa ra thông tin gì thêm.
+            Sau đó đưa ra 5 điểm đáng chú ý nhất của cả trải bài, giải thích theo ngôn ngữ dễ hiểu, đúng 5 điểm.
+            """
+        )
+    )
+    tarot_human_message = HumanMessagePromptTemplate.from_template("Các lá Tarot:\n{tarot_cards}")
+    question_human_message = HumanMessagePromptTemplate.from_template("Câu hỏi: {question}")
+    messages = [system_message, tarot_human_message, question_human_message]
     prompt = ChatPromptTemplate.from_messages(messages)
 
     def __call__(self, state: TarotTellingState):
-        self.prompt.extend([HumanMessage(content=m.content) for m in state["messages"] if isinstance(m, AIMessage)])
-        chain = self.prompt | self.chat_model_service.chat_model
-        message: AIMessage = chain.invoke({"question": state["messages"][0].content})
-        return TarotTellingState(message=[message], bot_messages=[TextMessage(message.content)])
+        chain = self.limit(self.prompt | self.chat_model_service.chat_model.with_structured_output(TarotReading))
+        spread = tarot_spreads[state["spread"]]
+        tcs = [tarot_deck[tarot_card_id] for tarot_card_id in state["tarot_card_ids"]]
+        tarot_cards = "\n".join(
+            f"{i}. Vị trí: {slot.position}\n   Lá Tarot: {tc.name}\n   Đảo ngược: {tc.is_reversed}\n   Ý nghĩa: {tc.meaning}"
+            for i, (slot, tc) in enumerate(zip(spread.slots, tcs), start=1)
+        )
+        reading: TarotReading = chain.invoke({"question": state["messages"][0].content, "tarot_cards": tarot_cards})
+
+        analyses = [
+            f"Vị trí: {analysis.position}\nLá bài: {analysis.card}\nPhân tích: {analysis.analysis}" for analysis in reading.analyses
+        ]
+        summary = "\n".join(f"- {point}" for point in reading.summary)
+        messages = [AIMessage(content=content) for content in [*analyses, summary]]
+        bot_messages = [TextMessage(content) for content in [*analyses, summary]]
+        return TarotTellingState(messages=messages, bot_messages=bot_messages)
@@ -0,0 +1,102 @@
+import hashlib
+import json
+import mmap
+import struct
+from functools import lru_cache
+from io import BytesIO
+from pathlib import Path
+
+from PIL import Image
+
+from app.core.logger import get_logger
+
+logger = get_logger(__name__)
+
+TAROT_PACK_PATH = Path(__file__).parent / "static" / "tarot.pack"
+TAROT_PACK_MAGIC = b"TAROTPK2"
+TAROT_PACK_HEADER = struct.Struct("<8sQI")
+
+
+@lru_cache(maxsize=32)
+def encode_tarot_card_image(image_path: Path, is_reversed: bool) -> bytes:
+    if not is_reversed:
+        return image_path.read_bytes()
+
+    with Image.open(image_path) as image:
+        buffer = BytesIO()
+        image.rotate(180).save(buffer, format="JPEG", quality=95)
+        return buffer.getvalue()
+
+
+@lru_cache(maxsize=4)
+def fingerprint_tarot_deck(names: tuple[str, ...], image_paths: tuple[Path, ...]) -> str:
+    # Covers card order, names and image contents, so a pack built from another deck is never trusted
+    digest = hashlib.sha256(TAROT_PACK_MAGIC)
+    for name, image_path in zip(names, image_paths):
+        digest.update(f"{name}\0{image_path.name}\0".encode())
+        digest.update(hashlib.sha256(image_path.read_bytes()).digest())
+    return digest.hexdigest()
+
+
+class TarotPack:
+    fingerprint: str
+    index: list[tuple[int, int]]
+
+    def __init__(self, path: Path):
+        with path.open("rb") as f:
+            self.buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.view = memoryview(self.buffer)
+
+        magic, index_offset, index_length = TAROT_PACK_HEADER.unpack_from(self.buffer)
+        if magic != TAROT_PACK_MAGIC:
+            raise ValueError(f"Invalid tarot pack: {path}")
+        index = json.loads(self.view[index_offset : index_offset + index_length].tobytes())
+        self.fingerprint = index["fingerprint"]
+        self.index = [(offset, length) for offset, length in index["images"]]
+
+    def __len__(self):
+        return len(self.index)
+
+    def __getitem__(self, id: int) -> memoryview:
+        offset, length = self.index[id]
+        return self.view[offset : offset + length]
+
+
+def build_tarot_pack(tarot_deck, path: Path = TAROT_PACK_PATH):
+    index: list[tuple[int, int]] = []
+    with path.open("wb") as f:
+        f.write(TAROT_PACK_HEADER.pack(TAROT_PACK_MAGIC, 0, 0))
+        for id in range(len(tarot_deck)):
+            variant = tarot_deck[id]
+            image = encode_tarot_card_image(variant.image_path, variant.is_reversed)
+            index.append((f.tell(), len(image)))
+            f.write(image)
+
+        index_offset = f.tell()
+        index_bytes = json.dumps({"fingerprint": tarot_deck.fingerprint, "images": index}).encode()
+        f.write(index_bytes)
+        f.seek(0)
+        f.write(TAROT_PACK_HEADER.pack(TAROT_PACK_MAGIC, index_offset, len(index_bytes)))
+
+
+@lru_cache(1)
+def load_tarot_pack(fingerprint: str, path: Path = TAROT_PACK_PATH) -> TarotPack | None:
+    if not path.exists():
+        logger.warning(f"Tarot pack not found at {path}, encoding images on demand")
+        return None
+    try:
+        tarot_pack = TarotPack(path)
+    except ValueError:
+        logger.warning(f"Tarot pack at {path} is in an old format, encoding images on demand")
+        return None
+    if tarot_pack.fingerprint != fingerprint:
+        logger.warning(f"Tarot pack at {path} was built from another deck, encoding images on demand")
+        return None
+    return tarot_pack
+
+
+if __name__ == "__main__":
+    from app.tarot.tarot_card_model import tarot_deck
+
+    build_tarot_pack(tarot_deck)
+    logger.info(f"Tarot pack written to {TAROT_PACK_PATH}")
@@ -0,0 +1,132 @@
+from dataclasses import dataclass
+from functools import lru_cache
+from io import BytesIO
+
+from PIL import Image
+
+from app.tarot.tarot_card_model import tarot_deck
+
+
+@dataclass(frozen=True)
+class TarotSpreadSlot:
+    position: str
+    x: float
+    y: float
+    is_crossing: bool = False
+
+
+@dataclass(frozen=True)
+class TarotSpread:
+    name: str
+    aliases: tuple[str, ...]
+    slots: tuple[TarotSpreadSlot, ...]
+
+    @property
+    def count(self):
+        return len(self.slots)
+
+
+one_card_spread = TarotSpread(
+    name="one-card",
+    aliases=("1",),
+    slots=(TarotSpreadSlot("Thông điệp", 0, 0),),
+)
+
+three_card_spread = TarotSpread(
+    name="three-card",
+    aliases=("3",),
+    slots=(
+        TarotSpreadSlot("Quá khứ", 0, 0),
+        TarotSpreadSlot("Hiện tại", 1, 0),
+        TarotSpreadSlot("Tương lai", 2, 0),
+    ),
+)
+
+five_card_spread = TarotSpread(
+    name="five-card",
+    aliases=("5",),
+    slots=(
+        TarotSpreadSlot("Hiện tại", 1, 1),
+        TarotSpreadSlot("Quá khứ", 0, 1),
+        TarotSpreadSlot("Tương lai", 2, 1),
+        TarotSpreadSlot("Tiềm năng", 1, 0),
+        TarotSpreadSlot("Nguyên nhân", 1, 2),
+    ),
+)
+
+celtic_cross_spread = TarotSpread(
+    name="celtic-cross",
+    aliases=("10", "celtic"),
+    slots=(
+        TarotSpreadSlot("Hiện tại", 1, 1.5),
+        TarotSpreadSlot("Thử thách", 1, 1.5, is_crossing=True),
+        TarotSpreadSlot("Nền tảng", 1, 2.5),
+        TarotSpreadSlot("Quá khứ", 0, 1.5),
+        TarotSpreadSlot("Mục tiêu", 1, 0.5),
+        TarotSpreadSlot("Tương lai gần", 2, 1.5),
+        TarotSpreadSlot("Bản thân", 3.5, 3),
+        TarotSpreadSlot("Môi trường xung quanh", 3.5, 2),
+        TarotSpreadSlot("Hy vọng và nỗi sợ", 3.5, 1),
+        TarotSpreadSlot("Kết quả", 3.5, 0),
+    ),
+)
+
+tarot_spreads = {
+    key: spread
+    for spread in [one_card_spread, three_card_spread, five_card_spread, celtic_cross_spread]
+    for key in [spread.name, *spread.aliases]
+}
+
+
+tarot_spread_separators = ":,.-|"
+
+
+def parse_tarot_spread(words: list[str], default: TarotSpread = three_card_spread) -> tuple[TarotSpread, list[str]]:
+    if not words:
+        return default, words
+    word = words[0].lower()
+    key = word.removeprefix("#").rstrip(tarot_spread_separators)
+    if key not in tarot_spreads:
+        return default, words
+    # A bare count may just start the question ("10 năm nữa ..."), so it needs a "#" prefix or a separator after it
+    if key != word or not key.isdigit():
+        return tarot_spreads[key], words[1:]
+    if len(words) > 1 and words[1] and all(char in tarot_spread_separators for char in words[1]):
+        return tarot_spreads[key], words[2:]
+    return default, words
+
+
+@lru_cache(maxsize=64)
+def render_tarot_spread(
+    spread: TarotSpread,
+    tarot_card_ids: tuple[int, ...],
+    card_height: int = 420,
+    gap: int = 24,
+    format_: str = "JPEG",
+    quality: int = 85,
+) -> bytes:
+    if len(tarot_card_ids) != spread.count:
+        raise ValueError(f"{spread.name} spread expects {spread.count} cards, got {len(tarot_card_ids)}")
+
+    cards: list[Image.Image] = []
+    for tarot_card_id in tarot_card_ids:
+        with Image.open(BytesIO(tarot_deck[tarot_card_id].image_bytes)) as image:
+            card_width = round(image.width * card_height / image.height)
+            cards.append(image.convert("RGB").resize((card_width, card_height), Image.Resampling.LANCZOS))
+
+    card_width = max(card.width for card in cards)
+    step_x, step_y = card_width + gap, card_height + gap
+    width = round(max(slot.x for slot in spread.slots) * step_x) + card_width + 2 * gap
+    height = round(max(slot.y for slot in spread.slots) * step_y) + card_height + 2 * gap
+
+    canvas = Image.new("RGB", (width, height), (24, 24, 32))
+    for slot, card in zip(spread.slots, cards):
+        if slot.is_crossing:
+            card = card.rotate(90, expand=True)
+        center_x = gap + round(slot.x * step_x) + card_width // 2
+        center_y = gap + round(slot.y * step_y) + card_height // 2
+        canvas.paste(card, (center_x - card.width // 2, center_y - card.height // 2))
+
+    buffer = BytesIO()
+    canvas.save(buffer, format=format_, quality=quality, optimize=True)
+    return buffer.getvalue()
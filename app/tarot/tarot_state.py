@@ -2,13 +2,14 @@ import operator
 from typing import Annotated, TypedDict
 
 from app.core.state import BotMessagesState
-from app.tarot.tarot_card_model import TarotCard
 
 
 class TarotTellingState(BotMessagesState):
-    tarot_cards: Annotated[list[TarotCard], operator.add]
+    spread: str
+    tarot_card_ids: Annotated[list[int], operator.add]
 
 
 class TarotCardAnalyzeState(TypedDict):
     question: str
-    tarot_card: TarotCard
+    position: str
+    tarot_card_id: int
@@ -1,7 +1,35 @@
+from io import BytesIO
+import threading
+import time
+from pathlib import Path
+
 import pytest
+from langchain_core.messages import AIMessage, HumanMessage
+from PIL import Image
 
+from app.bot.message import ImageAlbumMessage, ImageMessage
 from app.core.chat_model import ChatModelService
-from app.tarot.tarot_graph import TarotGraphService
+from app.tarot.tarot_card_model import TarotDeck, tarot_cards, tarot_deck
+from app.tarot.tarot_corpus import (
+    TarotCorpus,
+    classify_tarot_question,
+    fingerprint_tarot_corpus,
+    load_tarot_corpus,
+    tarot_question_categories,
+)
+from app.tarot.tarot_graph import TarotGraphMode, TarotGraphService
+from app.tarot.tarot_node import AnalyzeTarotCard, RandomizeTarotCards, SummarizeTarotCards
+from app.tarot.tarot_pack import TarotPack, build_tarot_pack, encode_tarot_card_image, load_tarot_pack
+from app.tarot.tarot_spread import (
+    TarotSpread,
+    celtic_cross_spread,
+    five_card_spread,
+    one_card_spread,
+    parse_tarot_spread,
+    render_tarot_spread,
+    three_card_spread,
+)
+from app.tarot.tarot_state import TarotTellingState
 
 
 class TestTarot:
@@ -13,7 +41,138 @@ class TestTarot:
     def question(self):
         return "Tôi nên làm gì hôm nay"
 
-    def test_graph(self, tarot_graph_service: TarotGraphService, question: str):
-        for node, state in tarot_graph_service.run(question):
+    def test_graph(self, tarot_graph_service: TarotGraphService, question: str, run_graph):
+        for node, state in run_graph(tarot_graph_service.run(question)):
+            print(f">>> {node}")
+            print(state)
+
+    def test_graph_single(self, chat_model_service: ChatModelService, question: str, run_graph):
+        tarot_graph_service = TarotGraphService(chat_model_service, mode=TarotGraphMode.single)
+        for node, state in run_graph(tarot_graph_service.run(question)):
             print(f">>> {node}")
             print(state)
+
+    def test_variant_image(self):
+        upright, reversed_ = tarot_deck[0], tarot_deck[1]
+        assert upright.name == reversed_.name == tarot_cards[0].name
+        assert (upright.meaning, reversed_.meaning) == tarot_cards[0].meanings
+        with Image.open(upright.image) as upright_image, Image.open(reversed_.image) as reversed_image:
+            assert upright_image.size == reversed_image.size
+        assert upright.image.getvalue() == tarot_cards[0].image_path.read_bytes()
+
+    def test_draw(self):
+        tarot_card_ids = tarot_deck.draw(10)
+        assert len({tarot_card_id >> 1 for tarot_card_id in tarot_card_ids}) == 10
+        assert all(0 <= tarot_card_id < len(tarot_deck) == 2 * len(tarot_cards) for tarot_card_id in tarot_card_ids)
+
+    def test_randomize(self):
+        state = TarotTellingState(spread=five_card_spread.name)
+        (composite,) = RandomizeTarotCards(composite=True)(state)["bot_messages"]
+        assert isinstance(composite, ImageMessage) and composite.filename.endswith(".jpg")
+        with Image.open(composite.image) as image:
+            assert image.format == "JPEG"
+
+        (album,) = RandomizeTarotCards(composite=False)(state)["bot_messages"]
+        assert isinstance(album, ImageAlbumMessage) and len(album.images) == len(album.keys) == five_card_spread.count
+
+    def test_pack(self, tmp_path: Path):
+        path = tmp_path / "tarot.pack"
+        build_tarot_pack(tarot_deck, path)
+        tarot_pack = TarotPack(path)
+
+        assert len(tarot_pack) == len(tarot_deck) and tarot_pack.fingerprint == tarot_deck.fingerprint
+        for tarot_card_id in range(len(tarot_deck)):
+            variant = tarot_deck[tarot_card_id]
+            assert tarot_pack[tarot_card_id] == encode_tarot_card_image(variant.image_path, variant.is_reversed)
+
+        reordered_deck = TarotDeck([tarot_cards[1], tarot_cards[0], *tarot_cards[2:]])
+        assert reordered_deck.fingerprint != tarot_deck.fingerprint
+        assert load_tarot_pack(tarot_deck.fingerprint, path) is not None
+        assert load_tarot_pack(reordered_deck.fingerprint, path) is None
+
+    @pytest.mark.parametrize("spread", [three_card_spread, five_card_spread, celtic_cross_spread])
+    def test_render_spread(self, spread: TarotSpread):
+        tarot_card_ids = tuple(2 * i + i % 2 for i in range(spread.count))
+        image_bytes = render_tarot_spread(spread, tarot_card_ids)
+
+        assert render_tarot_spread(spread, tarot_card_ids) is image_bytes
+        with Image.open(BytesIO(image_bytes)) as image:
+            assert image.format == "JPEG"
+
+    def test_summarize_prompt_isolation(self, fake_chat_model_service):
+        prompts = []
+        summarize_tarot_cards = SummarizeTarotCards(
+            fake_chat_model_service(lambda prompt: prompts.append(prompt.to_messages()) or AIMessage(content="summary"))
+        )
+        state = TarotTellingState(messages=[HumanMessage(content="question"), AIMessage(content="a" * 50000), AIMessage(content="b")])
+
+        summarize_tarot_cards(state)
+        summarize_tarot_cards(state)
+
+        assert len(prompts[0]) == len(prompts[1]) == 4
+        assert prompts[0][-1].content == "b"
+        assert sum(len(m.content) for m in prompts[0][2:]) <= summarize_tarot_cards.token_budget.max_tokens * 3
+
+    def test_parse_spread(self):
+        assert parse_tarot_spread(["celtic", "Tôi", "nên"]) == (celtic_cross_spread, ["Tôi", "nên"])
+        assert parse_tarot_spread(["#10", "Tôi", "nên"]) == (celtic_cross_spread, ["Tôi", "nên"])
+        assert parse_tarot_spread(["10:", "Tôi", "nên"]) == (celtic_cross_spread, ["Tôi", "nên"])
+        assert parse_tarot_spread(["10", "-", "Tôi", "nên"]) == (celtic_cross_spread, ["Tôi", "nên"])
+        assert parse_tarot_spread(["One-Card", "Tôi", "nên"]) == (one_card_spread, ["Tôi", "nên"])
+        assert parse_tarot_spread(["10", "năm", "nữa"]) == (three_card_spread, ["10", "năm", "nữa"])
+        assert parse_tarot_spread(["3", "tháng", "tới"]) == (three_card_spread, ["3", "tháng", "tới"])
+        assert parse_tarot_spread(["Tôi", "nên"]) == (three_card_spread, ["Tôi", "nên"])
+        assert parse_tarot_spread([]) == (three_card_spread, [])
+
+    def test_bounded_analysis(self, question: str, fake_chat_model_service, run_graph):
+        running, peaks = 0, []
+        lock = threading.Lock()
+
+        def chat_model(prompt):
+            nonlocal running
+            with lock:
+                running += 1
+                peaks.append(running)
+            time.sleep(0.05)
+            with lock:
+                running -= 1
+            return AIMessage(content="analysis")
+
+        tarot_graph_service = TarotGraphService(fake_chat_model_service(chat_model), max_concurrency=3)
+        nodes = [node for node, _ in run_graph(tarot_graph_service.run(question, celtic_cross_spread))]
+
+        assert nodes.count(AnalyzeTarotCard.__name__) == celtic_cross_spread.count
+        assert max(peaks) <= 3
+
+    def test_corpus(self, tmp_path: Path):
+        path = tmp_path / "tarot_corpus.json"
+        categories = list(tarot_question_categories)
+        interpretations = [f"{i}:{category}" for i in range(len(tarot_deck)) for category in categories]
+        fingerprint = fingerprint_tarot_corpus(tarot_deck)
+        TarotCorpus(categories, interpretations, fingerprint).dump(path)
+
+        tarot_corpus = load_tarot_corpus(fingerprint, path)
+        assert tarot_corpus.get(7, "tình yêu") == "7:tình yêu"
+        assert tarot_corpus.get(7, "unknown") is None
+
+        reordered_deck = TarotDeck([tarot_cards[1], tarot_cards[0], *tarot_cards[2:]])
+        with pytest.raises(ValueError):
+            load_tarot_corpus(fingerprint_tarot_corpus(reordered_deck), path)
+        with pytest.raises(FileNotFoundError):
+            load_tarot_corpus(fingerprint, tmp_path / "missing.json")
+
+    @pytest.mark.parametrize(
+        "question, category",
+        [
+            ("Tôi có nên chia tay người yêu không", "tình yêu"),
+            ("Tôi có nên tiến tới với anh ấy", "tình yêu"),
+            ("toi co nen chia tay nguoi yeu khong", "tình yêu"),
+            ("Sức khỏe của tôi dạo này yếu quá", "sức khỏe"),
+            ("Tôi có được lên trưởng phòng không", "công việc"),
+            ("Năm nay tôi có kiếm được nhiều tiền không", "tài chính"),
+            ("Đi làm hay đi học", "chung"),
+            ("Tôi nên làm gì hôm nay", "chung"),
+        ],
+    )
+    def test_classify_question(self, question: str, category: str):
+        assert classify_tarot_question(question) == category
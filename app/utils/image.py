@@ -1,10 +1,163 @@
 from base64 import b64encode
 from dataclasses import dataclass
+from enum import Enum
+from io import BytesIO
+import threading
+from typing import BinaryIO, NamedTuple, Protocol, Sequence
+
+import cv2
+import numpy
+from PIL import Image, ImageOps
+
+# Faces are detected on a small grayscale copy, the Haar cascade needs far fewer pixels than the model
+FACE_DETECTION_EDGE = 320
+# Sharpness is measured on the face scaled to a fixed size, so it does not depend on the photo resolution
+FACE_SHARPNESS_EDGE = 128
+
+face_cascades = threading.local()
 
 
 @dataclass
 class ImageBytesToB64:
     format_: str = "png"
 
-    def dump(self, image_bytes: bytearray):
+    def dump(self, image_bytes: bytes | bytearray):
         return f"data:image/{self.format_};base64,{b64encode(image_bytes).decode()}"
+
+
+def face_cascade() -> cv2.CascadeClassifier:
+    # CascadeClassifier is not thread safe, so every worker thread loads its own
+    if not hasattr(face_cascades, "cascade"):
+        face_cascades.cascade = cv2.CascadeClassifier(cv2.data.haarcascades + "haarcascade_frontalface_default.xml")
+    return face_cascades.cascade
+
+
+def detect_faces(image: Image.Image) -> list[tuple[int, int, int, int]]:
+    gray = ImageOps.grayscale(image)
+    scale = min(1.0, FACE_DETECTION_EDGE / max(gray.size))
+    if scale < 1.0:
+        gray = gray.resize((round(gray.width * scale), round(gray.height * scale)), Image.Resampling.BILINEAR)
+    min_size = max(24, min(gray.size) // 8)
+    faces = face_cascade().detectMultiScale(numpy.asarray(gray), scaleFactor=1.1, minNeighbors=5, minSize=(min_size, min_size))
+    return [tuple(round(value / scale) for value in face) for face in faces]
+
+
+def face_sharpness(image: Image.Image, face: tuple[int, int, int, int]) -> float:
+    x, y, w, h = face
+    gray = ImageOps.grayscale(image.crop((x, y, x + w, y + h))).resize(
+        (FACE_SHARPNESS_EDGE, FACE_SHARPNESS_EDGE), Image.Resampling.BILINEAR
+    )
+    return float(cv2.Laplacian(numpy.asarray(gray), cv2.CV_64F).var())
+
+
+class FaceCheck(str, Enum):
+    ok = "ok"
+    no_face = "no_face"
+    multiple_faces = "multiple_faces"
+    blurry = "blurry"
+
+
+class FaceHash(NamedTuple):
+    coarse: int
+    fine: int
+
+
+class PreparedImage(NamedTuple):
+    face_check: FaceCheck
+    image_url: str | None = None
+    image_hash: FaceHash | None = None
+
+
+def dhash(image: Image.Image, hash_size: int = 8) -> int:
+    # Each bit tells whether a pixel is brighter than its right neighbour, which survives rescaling and recompression
+    pixels = ImageOps.grayscale(image).resize((hash_size + 1, hash_size), Image.Resampling.LANCZOS).tobytes()
+    value = 0
+    for row in range(hash_size):
+        for col in range(hash_size):
+            offset = row * (hash_size + 1) + col
+            value = value << 1 | (pixels[offset] > pixels[offset + 1])
+    return value
+
+
+def face_hash(face_image: Image.Image) -> FaceHash:
+    # The coarse hash finds candidates, the fine one tells apart faces that only look alike at 8x8
+    return FaceHash(dhash(face_image), dhash(face_image, 16))
+
+
+class PhotoSize(Protocol):
+    width: int
+    height: int
+    file_size: int | None
+
+
+def select_photo_size[T: PhotoSize](photo_sizes: Sequence[T], min_edge: int) -> T:
+    photo_sizes = sorted(photo_sizes, key=lambda photo_size: photo_size.width * photo_size.height)
+    for photo_size in photo_sizes:
+        if min(photo_size.width, photo_size.height) >= min_edge:
+            return photo_size
+    return photo_sizes[-1]
+
+
+def load_image(image_bytes: bytes | bytearray | BinaryIO, max_edge: int | None = None) -> Image.Image:
+    image = Image.open(BytesIO(image_bytes) if isinstance(image_bytes, (bytes, bytearray)) else image_bytes)
+    if max_edge:
+        # JPEG decodes straight to a reduced scale, skipping most of the full-resolution pixels
+        image.draft("RGB", (max_edge, max_edge))
+    return ImageOps.exif_transpose(image).convert("RGB")
+
+
+@dataclass
+class ImagePreprocessor:
+    max_edge: int = 768
+    format_: str = "jpeg"
+    quality: int = 85
+    face_margin: float = 0.6
+
+    min_sharpness: float = 20.0
+
+    def crop_face(self, image: Image.Image, faces: list[tuple[int, int, int, int]]) -> Image.Image:
+        if not faces:
+            return image
+        x, y, w, h = max(faces, key=lambda face: face[2] * face[3])
+        # Keep hair, ears and chin, which the face box of the cascade leaves out
+        margin_x, margin_y = round(w * self.face_margin), round(h * self.face_margin)
+        return image.crop(
+            (max(0, x - margin_x), max(0, y - margin_y), min(image.width, x + w + margin_x), min(image.height, y + h + margin_y))
+        )
+
+    def preprocess(self, image: Image.Image, faces: list[tuple[int, int, int, int]] | None = None) -> Image.Image:
+        image = self.crop_face(image, detect_faces(image) if faces is None else faces)
+        image.thumbnail((self.max_edge, self.max_edge), Image.Resampling.LANCZOS)
+        return image
+
+    def encode(self, image: Image.Image) -> bytes:
+        with BytesIO() as buffer:
+            image.save(buffer, format=self.format_.upper(), quality=self.quality, optimize=True)
+            return buffer.getvalue()
+
+    def process(self, image_bytes: bytes | bytearray | BinaryIO) -> bytes:
+        return self.encode(self.preprocess(load_image(image_bytes, self.max_edge * 2)))
+
+    def dump(self, image_bytes: bytes | bytearray | BinaryIO) -> str:
+        return ImageBytesToB64(self.format_).dump(self.process(image_bytes))
+
+    def check_faces(self, image: Image.Image, faces: list[tuple[int, int, int, int]]) -> FaceCheck:
+        if not faces:
+            return FaceCheck.no_face
+        face = max(faces, key=lambda face: face[2] * face[3])
+        # Only faces of comparable size count, small background faces and cascade false positives do not make the subject ambiguous
+        if sum(other[2] * 2 >= face[2] for other in faces) > 1:
+            return FaceCheck.multiple_faces
+        if face_sharpness(image, face) < self.min_sharpness:
+            return FaceCheck.blurry
+        return FaceCheck.ok
+
+    def prepare(self, image_bytes: bytes | bytearray | BinaryIO) -> PreparedImage:
+        image = load_image(image_bytes, self.max_edge * 2)
+        faces = detect_faces(image)
+        face_check = self.check_faces(image, faces)
+        if face_check != FaceCheck.ok:
+            return PreparedImage(face_check)
+        # Only the face crop is hashed, similarly framed photos of different people must not share a reading
+        image_hash = face_hash(self.crop_face(image, faces))
+        return PreparedImage(face_check, ImageBytesToB64(self.format_).dump(self.encode(self.preprocess(image, faces))), image_hash)
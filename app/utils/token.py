@@ -0,0 +1,41 @@
+from dataclasses import dataclass
+from math import ceil
+
+
+@dataclass
+class TokenBudget:
+    max_tokens: int
+    chars_per_token: float = 3.0
+
+    def count(self, text: str) -> int:
+        return ceil(len(text) / self.chars_per_token)
+
+    def fit(self, texts: list[str]) -> list[str]:
+        if sum(self.count(text) for text in texts) <= self.max_tokens:
+            return texts
+
+        budgets = [0] * len(texts)
+        remaining = self.max_tokens
+        pending = sorted(range(len(texts)), key=lambda i: self.count(texts[i]))
+        while pending:
+            share = remaining // len(pending)
+            i = pending.pop(0)
+            budgets[i] = min(self.count(texts[i]), share)
+            remaining -= budgets[i]
+
+        return [text[: int(budget * self.chars_per_token)] for text, budget in zip(texts, budgets)]
+
+    def chunk(self, texts: list[str]) -> list[list[str]]:
+        chunks: list[list[str]] = []
+        chunk: list[str] = []
+        tokens = 0
+        for text in texts:
+            count = self.count(text)
+            if chunk and tokens + count > self.max_tokens:
+                chunks.append(chunk)
+                chunk, tokens = [], 0
+            chunk.append(text)
+            tokens += count
+        if chunk:
+            chunks.append(chunk)
+        return [self.fit(chunk) for chunk in chunks]
@@ -0,0 +1,98 @@
+import asyncio
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from io import BytesIO
+from threading import Lock
+from typing import NamedTuple
+
+from bson import Binary
+from PIL import Image
+import pymongo
+import pymongo.collection
+
+from app.core.database import MongoDBService
+from app.core.logger import get_logger
+from app.ziwei.ziwei_chart import ZiweiChart, build_ziwei_chart
+from app.ziwei.ziwei_model import ZiweiBirthchart
+from app.ziwei.ziwei_render import crop_ziwei_palaces, encode_ziwei_chart, render_ziwei_chart
+
+logger = get_logger(__name__)
+
+
+class ZiweiChartEntry(NamedTuple):
+    chart: ZiweiChart
+    image: bytes
+    tiles: dict[str, bytes]
+
+
+class ZiweiChartCache:
+    # Every birth minute maps to its own chart, so charts nobody has asked for in a while are left to expire
+    ttl = timedelta(days=30)
+
+    def __init__(self, mongodb_service: MongoDBService, maxsize: int = 256, max_workers: int = 4):
+        self.client = mongodb_service.client
+        self.maxsize = maxsize
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="ziwei-chart")
+        self.charts: OrderedDict[str, ZiweiChartEntry] = OrderedDict()
+        self.lock = Lock()
+        self.hits = 0
+        self.persistent_hits = 0
+        self.misses = 0
+        self.collection.create_index("expires_at", expireAfterSeconds=0)
+
+    @property
+    def collection(self) -> pymongo.collection.Collection:
+        return self.client["bap-be-bot"]["ziwei-charts"]
+
+    def get(self, birthchart: ZiweiBirthchart) -> ZiweiChartEntry:
+        birthdata = birthchart.birthdata()
+        key = birthdata.key
+        with self.lock:
+            if key in self.charts:
+                self.charts.move_to_end(key)
+                self.hits += 1
+                return self.charts[key]
+
+        document = self.collection.find_one({"_id": key})
+        if document:
+            chart, image_bytes = ZiweiChart.model_validate(document["chart"]), bytes(document["image"])
+            if "tiles" in document:
+                tiles = {arc: bytes(tile) for arc, tile in document["tiles"].items()}
+            else:
+                tiles = crop_ziwei_palaces(Image.open(BytesIO(image_bytes)), chart)
+            entry = ZiweiChartEntry(chart, image_bytes, tiles)
+            self.collection.update_one({"_id": key}, {"$set": {"expires_at": datetime.now(timezone.utc) + self.ttl}})
+            with self.lock:
+                self.persistent_hits += 1
+        else:
+            chart = build_ziwei_chart(birthdata)
+            image = render_ziwei_chart(chart)
+            entry = ZiweiChartEntry(chart, encode_ziwei_chart(image), crop_ziwei_palaces(image, chart))
+            self.collection.update_one(
+                {"_id": key},
+                {
+                    "$set": {
+                        "chart": chart.model_dump(),
+                        "image": Binary(entry.image),
+                        "tiles": {arc: Binary(tile) for arc, tile in entry.tiles.items()},
+                        "expires_at": datetime.now(timezone.utc) + self.ttl,
+                    }
+                },
+                upsert=True,
+            )
+            with self.lock:
+                self.misses += 1
+
+        with self.lock:
+            self.charts[key] = entry
+            while len(self.charts) > self.maxsize:
+                self.charts.popitem(last=False)
+        logger.debug(f"Ziwei chart cache {self.stats()}")
+        return entry
+
+    async def aget(self, birthchart: ZiweiBirthchart) -> ZiweiChartEntry:
+        return await asyncio.get_running_loop().run_in_executor(self.executor, self.get, birthchart)
+
+    def stats(self) -> dict[str, int]:
+        return {"hits": self.hits, "persistent_hits": self.persistent_hits, "misses": self.misses, "size": len(self.charts)}
@@ -0,0 +1,278 @@
+from datetime import date
+
+from pydantic import BaseModel, ConfigDict
+
+from app.ziwei.ziwei_lunar import TABLE_END_YEAR, TABLE_START_YEAR, LunarDate, lunar_to_solar, solar_to_lunar
+
+STEMS = ["Giáp", "Ất", "Bính", "Đinh", "Mậu", "Kỷ", "Canh", "Tân", "Nhâm", "Quý"]
+BRANCHES = ["Tý", "Sửu", "Dần", "Mão", "Thìn", "Tỵ", "Ngọ", "Mùi", "Thân", "Dậu", "Tuất", "Hợi"]
+PALACES = [
+    "Mệnh",
+    "Phụ Mẫu",
+    "Phúc Đức",
+    "Điền Trạch",
+    "Quan Lộc",
+    "Nô Bộc",
+    "Thiên Di",
+    "Tật Ách",
+    "Tài Bạch",
+    "Tử Tức",
+    "Phu Thê",
+    "Huynh Đệ",
+]
+NAP_AM = [
+    "Hải Trung Kim",
+    "Lư Trung Hỏa",
+    "Đại Lâm Mộc",
+    "Lộ Bàng Thổ",
+    "Kiếm Phong Kim",
+    "Sơn Đầu Hỏa",
+    "Giản Hạ Thủy",
+    "Thành Đầu Thổ",
+    "Bạch Lạp Kim",
+    "Dương Liễu Mộc",
+    "Tuyền Trung Thủy",
+    "Ốc Thượng Thổ",
+    "Tích Lịch Hỏa",
+    "Tùng Bách Mộc",
+    "Trường Lưu Thủy",
+    "Sa Trung Kim",
+    "Sơn Hạ Hỏa",
+    "Bình Địa Mộc",
+    "Bích Thượng Thổ",
+    "Kim Bạch Kim",
+    "Phú Đăng Hỏa",
+    "Thiên Hà Thủy",
+    "Đại Trạch Thổ",
+    "Thoa Xuyến Kim",
+    "Tang Đố Mộc",
+    "Đại Khê Thủy",
+    "Sa Trung Thổ",
+    "Thiên Thượng Hỏa",
+    "Thạch Lựu Mộc",
+    "Đại Hải Thủy",
+]
+CUC = {
+    "Thủy": ("Thủy Nhị Cục", 2),
+    "Mộc": ("Mộc Tam Cục", 3),
+    "Kim": ("Kim Tứ Cục", 4),
+    "Thổ": ("Thổ Ngũ Cục", 5),
+    "Hỏa": ("Hỏa Lục Cục", 6),
+}
+TRANG_SINH = ["Tràng Sinh", "Mộc Dục", "Quan Đới", "Lâm Quan", "Đế Vượng", "Suy", "Bệnh", "Tử", "Mộ", "Tuyệt", "Thai", "Dưỡng"]
+TRANG_SINH_START = {"Thủy": 8, "Thổ": 8, "Mộc": 11, "Kim": 5, "Hỏa": 2}
+
+# Offsets from Tử Vi (counter-clockwise) and from Thiên Phủ (clockwise)
+TU_VI_STARS = {"Tử Vi": 0, "Thiên Cơ": -1, "Thái Dương": -3, "Vũ Khúc": -4, "Thiên Đồng": -5, "Liêm Trinh": -8}
+THIEN_PHU_STARS = {
+    "Thiên Phủ": 0,
+    "Thái Âm": 1,
+    "Tham Lang": 2,
+    "Cự Môn": 3,
+    "Thiên Tướng": 4,
+    "Thiên Lương": 5,
+    "Thất Sát": 6,
+    "Phá Quân": 10,
+}
+
+# Hóa Lộc, Hóa Quyền, Hóa Khoa, Hóa Kỵ by year stem
+TU_HOA = ["Hóa Lộc", "Hóa Quyền", "Hóa Khoa", "Hóa Kỵ"]
+TU_HOA_STARS = [
+    ["Liêm Trinh", "Phá Quân", "Vũ Khúc", "Thái Dương"],
+    ["Thiên Cơ", "Thiên Lương", "Tử Vi", "Thái Âm"],
+    ["Thiên Đồng", "Thiên Cơ", "Văn Xương", "Liêm Trinh"],
+    ["Thái Âm", "Thiên Đồng", "Thiên Cơ", "Cự Môn"],
+    ["Tham Lang", "Thái Âm", "Hữu Bật", "Thiên Cơ"],
+    ["Vũ Khúc", "Tham Lang", "Thiên Lương", "Văn Khúc"],
+    ["Thái Dương", "Vũ Khúc", "Thái Âm", "Thiên Đồng"],
+    ["Cự Môn", "Thái Dương", "Văn Khúc", "Văn Xương"],
+    ["Thiên Lương", "Tử Vi", "Tả Phù", "Vũ Khúc"],
+    ["Phá Quân", "Cự Môn", "Thái Âm", "Tham Lang"],
+]
+LOC_TON = [2, 3, 5, 6, 5, 6, 8, 9, 11, 0]
+KHOI_VIET = [(1, 7), (0, 8), (11, 9), (11, 9), (1, 7), (0, 8), (6, 2), (6, 2), (3, 5), (3, 5)]
+TRIET = [(8, 9), (6, 7), (4, 5), (2, 3), (0, 1)]
+# Indexed by year branch % 4, i.e. the Thân-Tý-Thìn, Tỵ-Dậu-Sửu, Dần-Ngọ-Tuất and Hợi-Mão-Mùi groups
+HOA_LINH = [(2, 10), (3, 10), (1, 3), (9, 10)]
+THIEN_MA = [2, 11, 8, 5]
+DAO_HOA = [9, 6, 3, 0]
+
+
+class ZiweiPalace(BaseModel):
+    name: str
+    branch: int
+    stem: int
+    major_stars: list[str]
+    minor_stars: list[str]
+    trang_sinh: str
+    decade: int
+    is_body: bool = False
+
+    @property
+    def title(self):
+        return f"{STEMS[self.stem]} {BRANCHES[self.branch]}"
+
+
+class ZiweiBirthdata(BaseModel):
+    model_config = ConfigDict(frozen=True)
+
+    lunar_date: LunarDate
+    hour_branch: int
+    gender: int
+
+    @property
+    def key(self):
+        lunar_date = self.lunar_date
+        leap = "L" if lunar_date.is_leap else ""
+        return f"{lunar_date.year:04d}-{lunar_date.month:02d}{leap}-{lunar_date.day:02d}:{self.hour_branch:02d}:{self.gender}"
+
+
+class ZiweiChart(BaseModel):
+    year: int
+    month: int
+    day: int
+    gender: int
+
+    lunar_date: LunarDate
+    hour_branch: int
+    year_stem: int
+    year_branch: int
+    nap_am: str
+    cuc: str
+    menh_branch: int
+    than_branch: int
+    palaces: list[ZiweiPalace]
+
+    @property
+    def is_yang(self):
+        return self.year_stem % 2 == 0
+
+    @property
+    def is_forward(self):
+        return self.is_yang == bool(self.gender)
+
+    def palace_by_branch(self, branch: int) -> ZiweiPalace:
+        return next(palace for palace in self.palaces if palace.branch == branch)
+
+
+def hour_to_branch(hour: int) -> int:
+    return (hour + 1) // 2 % 12
+
+
+def canonicalize_ziwei_birthdata(year: int, month: int, day: int, hour: int, minute: int, gender: int) -> ZiweiBirthdata:
+    if not TABLE_START_YEAR <= year <= TABLE_END_YEAR:
+        raise ValueError(f"Year {year} is out of range")
+    date(year, month, day)
+    if not (0 <= hour < 24 and 0 <= minute < 60):
+        raise ValueError(f"Invalid time {hour}:{minute}")
+    if gender not in (0, 1):
+        raise ValueError(f"Invalid gender {gender}")
+    return ZiweiBirthdata(lunar_date=solar_to_lunar(day, month, year), hour_branch=hour_to_branch(hour), gender=gender)
+
+
+def nap_am(stem: int, branch: int) -> str:
+    return NAP_AM[(6 * stem - 5 * branch) % 60 // 2]
+
+
+def tu_vi_branch(cuc_number: int, lunar_day: int) -> int:
+    k = -lunar_day % cuc_number
+    q = (lunar_day + k) // cuc_number
+    return (2 + q - 1 + (-k if k % 2 else k)) % 12
+
+
+def build_ziwei_chart(birthdata: ZiweiBirthdata) -> ZiweiChart:
+    lunar_date, hour_branch, gender = birthdata.lunar_date, birthdata.hour_branch, birthdata.gender
+    # Births in the second half of a leap month are counted in the following month
+    lunar_month = lunar_date.month + int(lunar_date.is_leap and lunar_date.day > 15)
+    lunar_month = (lunar_month - 1) % 12 + 1
+    year_stem, year_branch = (lunar_date.year + 6) % 10, (lunar_date.year + 8) % 12
+    is_forward = (year_stem % 2 == 0) == bool(gender)
+    direction = 1 if is_forward else -1
+
+    menh_branch = (2 + lunar_month - 1 - hour_branch) % 12
+    than_branch = (2 + lunar_month - 1 + hour_branch) % 12
+    dan_stem = (year_stem % 5 * 2 + 2) % 10
+    stems = [(dan_stem + (branch - 2) % 12) % 10 for branch in range(12)]
+    cuc, cuc_number = CUC[nap_am(stems[menh_branch], menh_branch).split()[-1]]
+    cuc_element = cuc.split()[0]
+
+    stars: dict[int, tuple[list[str], list[str]]] = {branch: ([], []) for branch in range(12)}
+    tu_vi = tu_vi_branch(cuc_number, lunar_date.day)
+    thien_phu = (4 - tu_vi) % 12
+    major_branches = {star: (tu_vi + offset) % 12 for star, offset in TU_VI_STARS.items()}
+    major_branches |= {star: (thien_phu + offset) % 12 for star, offset in THIEN_PHU_STARS.items()}
+    for star, branch in major_branches.items():
+        stars[branch][0].append(star)
+
+    loc_ton = LOC_TON[year_stem]
+    khoi, viet = KHOI_VIET[year_stem]
+    hoa_tinh_start, linh_tinh_start = HOA_LINH[year_branch % 4]
+    minor_branches = {
+        "Văn Xương": (10 - hour_branch) % 12,
+        "Văn Khúc": (4 + hour_branch) % 12,
+        "Tả Phù": (4 + lunar_month - 1) % 12,
+        "Hữu Bật": (10 - lunar_month + 1) % 12,
+        "Lộc Tồn": loc_ton,
+        "Kình Dương": (loc_ton + 1) % 12,
+        "Đà La": (loc_ton - 1) % 12,
+        "Thiên Khôi": khoi,
+        "Thiên Việt": viet,
+        "Địa Không": (11 - hour_branch) % 12,
+        "Địa Kiếp": (11 + hour_branch) % 12,
+        "Hỏa Tinh": (hoa_tinh_start + direction * hour_branch) % 12,
+        "Linh Tinh": (linh_tinh_start - direction * hour_branch) % 12,
+        "Thiên Mã": THIEN_MA[year_branch % 4],
+        "Hồng Loan": (3 - year_branch) % 12,
+        "Thiên Hỷ": (9 - year_branch) % 12,
+        "Đào Hoa": DAO_HOA[year_branch % 4],
+        "Thiên Hình": (9 + lunar_month - 1) % 12,
+        "Thiên Riêu": (1 + lunar_month - 1) % 12,
+        "Thái Tuế": year_branch,
+    }
+    for star, branch in minor_branches.items():
+        stars[branch][1].append(star)
+
+    for hoa, star in zip(TU_HOA, TU_HOA_STARS[year_stem]):
+        branch = major_branches.get(star, minor_branches.get(star))
+        stars[branch][1].append(hoa)
+
+    tuan_start = (year_branch - year_stem - 2) % 12
+    for branch in (tuan_start, (tuan_start + 1) % 12):
+        stars[branch][1].append("Tuần")
+    for branch in TRIET[year_stem % 5]:
+        stars[branch][1].append("Triệt")
+
+    trang_sinh_start = TRANG_SINH_START[cuc_element]
+    palaces = []
+    for i, name in enumerate(PALACES):
+        branch = (menh_branch + i) % 12
+        major_stars, minor_stars = stars[branch]
+        palaces.append(
+            ZiweiPalace(
+                name=name,
+                branch=branch,
+                stem=stems[branch],
+                major_stars=major_stars,
+                minor_stars=minor_stars,
+                trang_sinh=TRANG_SINH[direction * (branch - trang_sinh_start) % 12],
+                decade=cuc_number + 10 * (direction * (branch - menh_branch) % 12),
+                is_body=branch == than_branch,
+            )
+        )
+
+    solar_date = lunar_to_solar(lunar_date)
+    return ZiweiChart(
+        year=solar_date.year,
+        month=solar_date.month,
+        day=solar_date.day,
+        gender=gender,
+        lunar_date=lunar_date,
+        hour_branch=hour_branch,
+        year_stem=year_stem,
+        year_branch=year_branch,
+        nap_am=nap_am(year_stem, year_branch),
+        cuc=cuc,
+        menh_branch=menh_branch,
+        than_branch=than_branch,
+        palaces=palaces,
+    )
@@ -1,7 +1,13 @@
+from enum import Enum
+from uuid import uuid4
+
 from langchain_core.messages import HumanMessage
+from langgraph.checkpoint.base import BaseCheckpointSaver
 from langgraph.graph import StateGraph, START, END
 
-from app.core.chat_model import ChatModelService
+from app.core.chat_model import ChatModelService, chat_model_retry_policy
+from app.ziwei.ziwei_cache import ZiweiChartCache
+from app.ziwei.ziwei_model import ZiweiArcAnalysis, ZiweiBirthchart
 from app.ziwei.ziwei_state import ZiweiTellingState
 from app.ziwei.ziwei_node import (
     ExtractZiweiBirthchart,
@@ -10,22 +16,33 @@ from app.ziwei.ziwei_node import (
     HandleZiweiBirthchartError,
     DumpZiweiBirthchartImage,
     AnalyzeZiweiArc,
+    AnalyzeZiweiArcs,
     DumpZiweiArcAnalysis,
-    MapSummarizeZiwei,
     SummarizeZiwei,
 )
 
 
+class ZiweiGraphMode(str, Enum):
+    fanout = "fanout"
+    single = "single"
+    stream = "stream"
+
+
 class ZiweiGraphService:
-    def __init__(self, chat_model_service: ChatModelService):
+    def __init__(
+        self,
+        chat_model_service: ChatModelService,
+        ziwei_chart_cache: ZiweiChartCache,
+        mode: ZiweiGraphMode = ZiweiGraphMode.fanout,
+        checkpointer: BaseCheckpointSaver | None = None,
+    ):
         workflow = StateGraph(ZiweiTellingState)
 
-        workflow.add_node(ExtractZiweiBirthchart.__name__, ExtractZiweiBirthchart(chat_model_service))
+        workflow.add_node(ExtractZiweiBirthchart.__name__, ExtractZiweiBirthchart(chat_model_service), retry_policy=chat_model_retry_policy)
         workflow.add_node(HandleZiweiBirthchartError.__name__, HandleZiweiBirthchartError())
-        workflow.add_node(DumpZiweiBirthchartImage.__name__, DumpZiweiBirthchartImage())
-        workflow.add_node(AnalyzeZiweiArc.__name__, AnalyzeZiweiArc(chat_model_service))
+        workflow.add_node(DumpZiweiBirthchartImage.__name__, DumpZiweiBirthchartImage(ziwei_chart_cache))
         workflow.add_node(DumpZiweiArcAnalysis.__name__, DumpZiweiArcAnalysis())
-        workflow.add_node(SummarizeZiwei.__name__, SummarizeZiwei(chat_model_service))
+        workflow.add_node(SummarizeZiwei.__name__, SummarizeZiwei(chat_model_service), retry_policy=chat_model_retry_policy)
 
         workflow.add_edge(START, ExtractZiweiBirthchart.__name__)
 
@@ -35,25 +52,48 @@ class ZiweiGraphService:
             {True: HandleZiweiBirthchartError.__name__, False: DumpZiweiBirthchartImage.__name__},
         )
         workflow.add_edge(HandleZiweiBirthchartError.__name__, END)
-
-        workflow.add_conditional_edges(
-            DumpZiweiBirthchartImage.__name__,
-            MapAnalyzeZiweiArcs(AnalyzeZiweiArc.__name__),
-            [AnalyzeZiweiArc.__name__],
-        )
-        workflow.add_edge(AnalyzeZiweiArc.__name__, DumpZiweiArcAnalysis.__name__)
-        workflow.add_conditional_edges(
-            DumpZiweiArcAnalysis.__name__,
-            MapSummarizeZiwei(SummarizeZiwei.__name__),
-            [SummarizeZiwei.__name__],
-        )
+        workflow.add_edge(DumpZiweiArcAnalysis.__name__, SummarizeZiwei.__name__)
         workflow.add_edge(SummarizeZiwei.__name__, END)
 
-        self.graph = workflow.compile()
+        if mode == ZiweiGraphMode.single:
+            workflow.add_node(
+                AnalyzeZiweiArcs.__name__,
+                AnalyzeZiweiArcs(chat_model_service, ziwei_chart_cache),
+                retry_policy=chat_model_retry_policy,
+            )
+            workflow.add_edge(DumpZiweiBirthchartImage.__name__, AnalyzeZiweiArcs.__name__)
+            workflow.add_edge(AnalyzeZiweiArcs.__name__, DumpZiweiArcAnalysis.__name__)
+        else:
+            analyze_ziwei_arc = AnalyzeZiweiArc(chat_model_service, ziwei_chart_cache, stream=mode == ZiweiGraphMode.stream)
+            workflow.add_node(AnalyzeZiweiArc.__name__, analyze_ziwei_arc, retry_policy=chat_model_retry_policy)
+            workflow.add_conditional_edges(
+                DumpZiweiBirthchartImage.__name__,
+                MapAnalyzeZiweiArcs(AnalyzeZiweiArc.__name__),
+                [AnalyzeZiweiArc.__name__],
+            )
+            workflow.add_edge(AnalyzeZiweiArc.__name__, DumpZiweiArcAnalysis.__name__)
+
+        if checkpointer:
+            checkpointer = checkpointer.with_allowlist(
+                [(model.__module__, model.__name__) for model in (ZiweiBirthchart, ZiweiArcAnalysis)]
+            )
+        self.checkpointer = checkpointer
+        self.graph = workflow.compile(checkpointer=checkpointer)
 
-    def run(self, question: str):
+    async def run(self, question: str, thread_id: str | None = None):
+        config = {"configurable": {"thread_id": thread_id or uuid4().hex}}
         initial_state = ZiweiTellingState(messages=[HumanMessage(content=question)])
+        if self.checkpointer:
+            # An interrupted run of the same thread resumes after its last completed superstep
+            if (await self.graph.aget_state(config)).next:
+                initial_state = None
+            else:
+                await self.checkpointer.adelete_thread(config["configurable"]["thread_id"])
+
         state: dict[str, ZiweiTellingState]
-        for state in self.graph.stream(initial_state):
+        async for state in self.graph.astream(initial_state, config):
             for node_id, state_value in state.items():
                 yield (node_id, state_value)
+
+        if self.checkpointer:
+            await self.checkpointer.adelete_thread(config["configurable"]["thread_id"])
@@ -5,12 +5,21 @@ from telegram import Update
 from telegram.ext import CommandHandler, ContextTypes
 
 from app.core.chat_model import ChatModelService
-from app.ziwei.ziwei_graph import ZiweiGraphService
+from app.core.checkpoint import MongoDBCheckpointSaver, checkpoint_thread_id
+from app.core.database import MongoDBService
+from app.core.settings import Settings
+from app.ziwei.ziwei_cache import ZiweiChartCache
+from app.ziwei.ziwei_graph import ZiweiGraphMode, ZiweiGraphService
 
 
 class ZiweiHandler:
-    def __init__(self, chat_model_service: ChatModelService):
-        self.ziwei_graph_service = ZiweiGraphService(chat_model_service)
+    def __init__(self, chat_model_service: ChatModelService, mongodb_service: MongoDBService, settings: Settings):
+        self.ziwei_graph_service = ZiweiGraphService(
+            chat_model_service,
+            ZiweiChartCache(mongodb_service, max_workers=settings.ziwei_chart_max_workers),
+            mode=ZiweiGraphMode(settings.ziwei_graph_mode),
+            checkpointer=MongoDBCheckpointSaver(mongodb_service),
+        )
 
     @classmethod
     def syntax(cls):
@@ -25,13 +34,11 @@ class ZiweiHandler:
                 return
 
             question = " ".join(context.args)
-            for _, state in self.ziwei_graph_service.run(question):
-                bot_messages = state.get("bot_messages", [])
-                if not bot_messages:
-                    continue
-                bot_message = bot_messages[-1]
-                await bot_message.reply_telegram(update)
-                await asyncio.sleep(0.25)
+            thread_id = checkpoint_thread_id(self.syntax()[0], update.message.chat.id, update.effective_user.id, question)
+            async for _, state in self.ziwei_graph_service.run(question, thread_id):
+                for bot_message in state.get("bot_messages", []):
+                    await bot_message.reply_telegram(update)
+                    await asyncio.sleep(0.25)
 
         return CommandHandler(self.syntax()[0], handler)
 
@@ -44,13 +51,10 @@ class ZiweiHandler:
 
             await ctx.reply("⏳ Đang luận giải...")
 
-            for _, state in self.ziwei_graph_service.run(question):
-                bot_messages = state.get("bot_messages", [])
-                if not bot_messages:
-                    continue
-
-                bot_message = bot_messages[-1]
-                await bot_message.reply_discord(ctx)
-                await asyncio.sleep(0.25)
+            thread_id = checkpoint_thread_id(self.syntax()[0], ctx.channel.id, ctx.author.id, question)
+            async for _, state in self.ziwei_graph_service.run(question, thread_id):
+                for bot_message in state.get("bot_messages", []):
+                    await bot_message.reply_discord(ctx)
+                    await asyncio.sleep(0.25)
 
         return handler
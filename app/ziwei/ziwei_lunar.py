@@ -0,0 +1,204 @@
+from array import array
+from datetime import date
+from functools import lru_cache
+from math import floor, pi, sin
+
+from pydantic import BaseModel
+
+# Vietnamese lunar calendar after Ho Ngoc Duc's astronomical algorithm, computed for UTC+7
+TIME_ZONE = 7
+LUNAR_EPOCH = 2415021.076998695
+SYNODIC_MONTH = 29.530588853
+TABLE_START_YEAR = 1900
+TABLE_END_YEAR = 2100
+
+
+class LunarDate(BaseModel):
+    year: int
+    month: int
+    day: int
+    is_leap: bool = False
+
+
+def jd_from_date(day: int, month: int, year: int) -> int:
+    a = (14 - month) // 12
+    y = year + 4800 - a
+    m = month + 12 * a - 3
+    jd = day + (153 * m + 2) // 5 + 365 * y + y // 4 - y // 100 + y // 400 - 32045
+    if jd < 2299161:
+        jd = day + (153 * m + 2) // 5 + 365 * y + y // 4 - 32083
+    return jd
+
+
+def jd_to_date(jd: int) -> date:
+    if jd > 2299160:
+        a = jd + 32044
+        b = (4 * a + 3) // 146097
+        c = a - (b * 146097) // 4
+    else:
+        b = 0
+        c = jd + 32082
+    d = (4 * c + 3) // 1461
+    e = c - (1461 * d) // 4
+    m = (5 * e + 2) // 153
+    day = e - (153 * m + 2) // 5 + 1
+    month = m + 3 - 12 * (m // 10)
+    year = b * 100 + d - 4800 + m // 10
+    return date(year, month, day)
+
+
+def new_moon(k: int) -> float:
+    t = k / 1236.85
+    t2 = t * t
+    t3 = t2 * t
+    dr = pi / 180
+    jd1 = 2415020.75933 + 29.53058868 * k + 0.0001178 * t2 - 0.000000155 * t3
+    jd1 += 0.00033 * sin((166.56 + 132.87 * t - 0.009173 * t2) * dr)
+    m = 359.2242 + 29.10535608 * k - 0.0000333 * t2 - 0.00000347 * t3
+    mpr = 306.0253 + 385.81691806 * k + 0.0107306 * t2 + 0.00001236 * t3
+    f = 21.2964 + 390.67050646 * k - 0.0016528 * t2 - 0.00000239 * t3
+    c1 = (0.1734 - 0.000393 * t) * sin(m * dr) + 0.0021 * sin(2 * dr * m)
+    c1 = c1 - 0.4068 * sin(mpr * dr) + 0.0161 * sin(dr * 2 * mpr)
+    c1 = c1 - 0.0004 * sin(dr * 3 * mpr)
+    c1 = c1 + 0.0104 * sin(dr * 2 * f) - 0.0051 * sin(dr * (m + mpr))
+    c1 = c1 - 0.0074 * sin(dr * (m - mpr)) + 0.0004 * sin(dr * (2 * f + m))
+    c1 = c1 - 0.0004 * sin(dr * (2 * f - m)) - 0.0006 * sin(dr * (2 * f + mpr))
+    c1 = c1 + 0.0010 * sin(dr * (2 * f - mpr)) + 0.0005 * sin(dr * (2 * mpr + m))
+    if t < -11:
+        delta_t = 0.001 + 0.000839 * t + 0.0002261 * t2 - 0.00000845 * t3 - 0.000000081 * t * t3
+    else:
+        delta_t = -0.000278 + 0.000265 * t + 0.000262 * t2
+    return jd1 + c1 - delta_t
+
+
+def sun_longitude(jdn: float) -> float:
+    t = (jdn - 2451545.0) / 36525
+    t2 = t * t
+    dr = pi / 180
+    m = 357.52910 + 35999.05030 * t - 0.0001559 * t2 - 0.00000048 * t * t2
+    l0 = 280.46645 + 36000.76983 * t + 0.0003032 * t2
+    dl = (1.914600 - 0.004817 * t - 0.000014 * t2) * sin(dr * m)
+    dl = dl + (0.019993 - 0.000101 * t) * sin(dr * 2 * m) + 0.000290 * sin(dr * 3 * m)
+    longitude = (l0 + dl) * dr
+    return longitude - pi * 2 * floor(longitude / (pi * 2))
+
+
+def get_new_moon_day(k: int) -> int:
+    return floor(new_moon(k) + 0.5 + TIME_ZONE / 24)
+
+
+def get_sun_longitude(day_number: int) -> int:
+    return floor(sun_longitude(day_number - 0.5 - TIME_ZONE / 24) / pi * 6)
+
+
+def get_lunar_month_11(year: int) -> int:
+    k = floor((jd_from_date(31, 12, year) - 2415021) / SYNODIC_MONTH)
+    month_start = get_new_moon_day(k)
+    if get_sun_longitude(month_start) >= 9:
+        month_start = get_new_moon_day(k - 1)
+    return month_start
+
+
+def get_leap_month_offset(a11: int) -> int:
+    k = floor((a11 - LUNAR_EPOCH) / SYNODIC_MONTH + 0.5)
+    i = 1
+    arc = get_sun_longitude(get_new_moon_day(k + i))
+    while True:
+        last = arc
+        i += 1
+        arc = get_sun_longitude(get_new_moon_day(k + i))
+        if arc == last or i >= 14:
+            break
+    return i - 1
+
+
+def compute_lunar_date(day_number: int, year: int) -> LunarDate:
+    k = floor((day_number - LUNAR_EPOCH) / SYNODIC_MONTH) + 1
+    month_start = get_new_moon_day(k)
+    while month_start > day_number:
+        k -= 1
+        month_start = get_new_moon_day(k)
+
+    a11 = get_lunar_month_11(year)
+    b11 = a11
+    if a11 >= month_start:
+        lunar_year = year
+        a11 = get_lunar_month_11(year - 1)
+    else:
+        lunar_year = year + 1
+        b11 = get_lunar_month_11(year + 1)
+
+    lunar_day = day_number - month_start + 1
+    diff = floor((month_start - a11) / 29)
+    is_leap = False
+    lunar_month = diff + 11
+    if b11 - a11 > 365:
+        leap_month_diff = get_leap_month_offset(a11)
+        if diff >= leap_month_diff:
+            lunar_month = diff + 10
+            is_leap = diff == leap_month_diff
+    if lunar_month > 12:
+        lunar_month -= 12
+    if lunar_month >= 11 and diff < 4:
+        lunar_year -= 1
+    return LunarDate(year=lunar_year, month=lunar_month, day=lunar_day, is_leap=is_leap)
+
+
+class LunarTable:
+    # month_starts[i] is the julian day of the i-th lunar month, labels[i] packs its year, month and leap flag
+    def __init__(self, start_year: int = TABLE_START_YEAR, end_year: int = TABLE_END_YEAR):
+        self.first_day = jd_from_date(1, 1, start_year)
+        self.last_day = jd_from_date(31, 12, end_year)
+        self.month_starts = array("i")
+        self.labels = array("i")
+        self.indices: dict[int, int] = {}
+
+        k = floor((self.first_day - LUNAR_EPOCH) / SYNODIC_MONTH)
+        while not self.month_starts or self.month_starts[-1] <= self.last_day:
+            month_start = get_new_moon_day(k)
+            lunar_date = compute_lunar_date(month_start, jd_to_date(month_start).year)
+            self.month_starts.append(month_start)
+            self.labels.append(self.label(lunar_date.year, lunar_date.month, lunar_date.is_leap))
+            self.indices[self.labels[-1]] = len(self.month_starts) - 1
+            k += 1
+
+    @staticmethod
+    def label(year: int, month: int, is_leap: bool) -> int:
+        return year * 32 + month * 2 + int(is_leap)
+
+    def __contains__(self, day_number: int) -> bool:
+        return self.first_day <= day_number <= self.last_day
+
+    def to_lunar(self, day_number: int) -> LunarDate:
+        i = int((day_number - self.month_starts[0]) / SYNODIC_MONTH)
+        while self.month_starts[i] > day_number:
+            i -= 1
+        while self.month_starts[i + 1] <= day_number:
+            i += 1
+        year, rest = divmod(self.labels[i], 32)
+        return LunarDate(year=year, month=rest // 2, day=day_number - self.month_starts[i] + 1, is_leap=bool(rest % 2))
+
+    def to_solar(self, lunar_date: LunarDate) -> int:
+        i = self.indices.get(self.label(lunar_date.year, lunar_date.month, lunar_date.is_leap))
+        if i is None or i + 1 >= len(self.month_starts):
+            raise ValueError(f"Invalid lunar month {lunar_date.month}{' (leap)' if lunar_date.is_leap else ''}/{lunar_date.year}")
+        if not 1 <= lunar_date.day <= self.month_starts[i + 1] - self.month_starts[i]:
+            raise ValueError(f"Invalid lunar day {lunar_date.day}")
+        return self.month_starts[i] + lunar_date.day - 1
+
+
+@lru_cache(1)
+def load_lunar_table() -> LunarTable:
+    return LunarTable()
+
+
+def solar_to_lunar(day: int, month: int, year: int) -> LunarDate:
+    day_number = jd_from_date(day, month, year)
+    lunar_table = load_lunar_table()
+    if day_number in lunar_table:
+        return lunar_table.to_lunar(day_number)
+    return compute_lunar_date(day_number, year)
+
+
+def lunar_to_solar(lunar_date: LunarDate) -> date:
+    return jd_to_date(load_lunar_table().to_solar(lunar_date))
@@ -1,18 +1,11 @@
-import base64
-from io import BytesIO
 from typing import Annotated
-from uuid import uuid4
 
-from bs4 import BeautifulSoup
-import pymupdf
-from pydantic import BaseModel, ConfigDict, Field
-from pydantic.json_schema import SkipJsonSchema
-import requests
+from pydantic import BaseModel, Field
 
+from app.ziwei.ziwei_chart import ZiweiBirthdata, canonicalize_ziwei_birthdata
 
-class ZiweiBirthchart(BaseModel):
-    model_config = ConfigDict(arbitrary_types_allowed=True)
 
+class ZiweiBirthchart(BaseModel):
     year: Annotated[int, Field(description="The user's birth year")]
     month: Annotated[int, Field(description="The user's birth month")]
     day: Annotated[int, Field(description="The user's birth day")]
@@ -22,41 +15,20 @@ class ZiweiBirthchart(BaseModel):
 
     error: Annotated[bool, Field(default=False, description="If error, set to True, else False")]
 
-    image_b64: Annotated[str | None, SkipJsonSchema(), Field(default=None, exclude=True)]
-    image: Annotated[BytesIO | None, SkipJsonSchema(), Field(default=None, exclude=True)]
-
-    def model_post_init(self, *args):
-        if self.error:
-            return
-
-        with requests.post(
-            "https://xem.tracuutuvi.com/",
-            data={
-                "full_name": str(uuid4()),
-                "gender": str(self.gender),
-                "lich": 1,
-                "hour": str(self.hour),
-                "minute": str(self.minute),
-                "day": str(self.day),
-                "month": str(self.month),
-                "year": str(self.year),
-            },
-        ) as r:
-            code_response = r.text
-        soup = BeautifulSoup(code_response, features="html.parser")
-        code = soup.find("div", {"id": "result-content"})["code"]
-
-        with requests.get(f"https://xem.tracuutuvi.com/pdf/laso_pdf?c={code}") as r:
-            pdf_buf = BytesIO(r.content)
-
-        with pymupdf.open(stream=pdf_buf.getvalue(), filetype="pdf") as doc:
-            pix = doc[0].get_pixmap(dpi=150)
-
-        image_bytes = pix.tobytes("png")
-        self.image_b64 = f"data:image/png;base64,{base64.b64encode(image_bytes).decode()}"
-        self.image = BytesIO(image_bytes)
+    def birthdata(self) -> ZiweiBirthdata:
+        return canonicalize_ziwei_birthdata(self.year, self.month, self.day, self.hour, self.minute, self.gender)
 
 
 class ZiweiArcAnalysis(BaseModel):
-    arc: str
-    analysis: str
+    arc: Annotated[str, Field(description="The palace's name")]
+    analysis: Annotated[str, Field(description="Analysis of the palace's stars, their positions and interactions")]
+
+
+class ZiweiReading(BaseModel):
+    analyses: Annotated[list[ZiweiArcAnalysis], Field(description="One analysis per palace, in the order the palaces were listed")]
+
+
+class ZiweiSentimentSummary(BaseModel):
+    positives: Annotated[list[str], Field(description="Exactly 5 most positive points of the chart, in plain language")]
+    negatives: Annotated[list[str], Field(description="Exactly 5 most negative points of the chart, in plain language")]
+    advices: Annotated[list[str], Field(description="Exactly 5 most important advices for the person, in plain language")]
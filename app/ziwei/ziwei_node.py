@@ -1,14 +1,23 @@
-from io import StringIO
+import base64
+from io import BytesIO, StringIO
 from textwrap import dedent
+from threading import Lock
 
-from langchain_core.messages import AIMessage, SystemMessage
-from langchain_core.prompts import ChatPromptTemplate, HumanMessagePromptTemplate, SystemMessagePromptTemplate
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
+from langchain_core.prompts import ChatPromptTemplate, HumanMessagePromptTemplate, MessagesPlaceholder
 from langgraph.types import Send
 
 from app.bot.message import FileMessage, ImageMessage, TextMessage
 from app.core.chat_model import ChatModelService, ChatModelNode
-from app.ziwei.ziwei_model import ZiweiArcAnalysis, ZiweiBirthchart
-from app.ziwei.ziwei_state import ZiweiArcAnalysisState, ZiweiTellingState, ZiweiSummaryState
+from app.core.logger import get_logger
+from app.utils.token import TokenBudget
+from app.ziwei.ziwei_cache import ZiweiChartCache
+from app.ziwei.ziwei_model import ZiweiArcAnalysis, ZiweiBirthchart, ZiweiReading, ZiweiSentimentSummary
+from app.ziwei.ziwei_parser import parse_ziwei_birthchart
+from app.ziwei.ziwei_render import ziwei_chart_info
+from app.ziwei.ziwei_state import ZiweiArcAnalysisState, ZiweiTellingState
+
+logger = get_logger(__name__)
 
 
 class ExtractZiweiBirthchart(ChatModelNode):
@@ -17,11 +26,34 @@ class ExtractZiweiBirthchart(ChatModelNode):
     human_message = HumanMessagePromptTemplate.from_template("{message}")
     prompt = ChatPromptTemplate.from_messages([system_message, human_message])
 
+    def __init__(self, chat_model_service: ChatModelService):
+        super().__init__(chat_model_service)
+        self.lock = Lock()
+        self.parsed = 0
+        self.fallbacks = 0
+
     def __call__(self, state: ZiweiTellingState):
-        chain = self.prompt | self.chat_model_service.chat_model.with_structured_output(ZiweiBirthchart)
-        birthchart: ZiweiBirthchart = chain.invoke(state["messages"][-1].content)
+        content = state["messages"][-1].content
+        birthchart = parse_ziwei_birthchart(content)
+        if birthchart:
+            with self.lock:
+                self.parsed += 1
+        else:
+            chain = self.limit(self.prompt | self.chat_model_service.chat_model.with_structured_output(ZiweiBirthchart))
+            birthchart: ZiweiBirthchart = chain.invoke(content)
+            with self.lock:
+                self.fallbacks += 1
+        logger.debug(f"Ziwei birthchart parser {self.stats()}")
+        if not birthchart.error:
+            try:
+                birthchart.birthdata()
+            except ValueError:
+                birthchart.error = True
         return ZiweiTellingState(birthchart=birthchart)
 
+    def stats(self) -> dict[str, int]:
+        return {"parsed": self.parsed, "fallbacks": self.fallbacks}
+
 
 class ValidateZiweiBirthchart:
     def __call__(self, state: ZiweiTellingState):
@@ -35,8 +67,14 @@ class HandleZiweiBirthchartError:
 
 
 class DumpZiweiBirthchartImage:
-    def __call__(self, state: ZiweiTellingState):
-        return ZiweiTellingState(bot_messages=[ImageMessage(state["birthchart"].image, "Lá số Tử Vi")])
+    ziwei_chart_cache: ZiweiChartCache
+
+    def __init__(self, ziwei_chart_cache: ZiweiChartCache):
+        self.ziwei_chart_cache = ziwei_chart_cache
+
+    async def __call__(self, state: ZiweiTellingState):
+        entry = await self.ziwei_chart_cache.aget(state["birthchart"])
+        return ZiweiTellingState(bot_messages=[ImageMessage(BytesIO(entry.image), "Lá số Tử Vi")])
 
 
 class MapAnalyzeZiweiArcs:
@@ -64,12 +102,13 @@ class MapAnalyzeZiweiArcs:
 
 
 class AnalyzeZiweiArc(ChatModelNode):
+    ziwei_chart_cache: ZiweiChartCache
     system_message = SystemMessage(
         content=dedent(
             """
             Bạn là một nhà chiêm tinh và chuyên gia tử vi đẩu số Việt Nam. Sử dụng lá số tử vi đẩu số sau đây làm ngữ cảnh, hãy phân tích và đưa ra những nhận định về lá số này.
             Phân tích cần dựa trên kiến thức phong thủy và tử vi đẩu số truyền thống Việt Nam, kết hợp giữa các yếu tố âm dương, ngũ hành, cung mệnh và con giáp.
-            Hãy phân tích chi tiết về Cung được nêu trong trong yêu cầu. Đầu tiên, hãy xác định đúng ô (cung) cần tìm, sau đó phân tích các sao, vị trí của sao, tương tác giữa các sao.
+            Hãy phân tích chi tiết về Cung được nêu trong trong yêu cầu. Hình ảnh đính kèm là ô của chính cung đó trên lá số, kèm theo thông tin chung của lá số. Hãy phân tích các sao, vị trí của sao, tương tác giữa các sao.
             Khi trả lời, chỉ đưa ra phân tích, không đưa ra giới thiệu về cung. Ngoài ra không đưa ra thông tin gì thêm
             Đưa ra Kết quả phân tích theo định dạng
             Cung: <cung>
@@ -79,17 +118,69 @@ class AnalyzeZiweiArc(ChatModelNode):
     )
     human_message = HumanMessagePromptTemplate.from_template(
         template=[
-            {"type": "text", "text": "Phân tích Cung {arc}"},
+            {"type": "text", "text": "Phân tích Cung {arc}\n{info}"},
             {"type": "image_url", "image_url": "{image}"},
         ]
     )
     prompt = ChatPromptTemplate.from_messages([system_message, human_message])
 
+    def __init__(self, chat_model_service: ChatModelService, ziwei_chart_cache: ZiweiChartCache, stream: bool = False):
+        super().__init__(chat_model_service)
+        self.ziwei_chart_cache = ziwei_chart_cache
+        self.stream = stream
+
     def __call__(self, state: ZiweiArcAnalysisState):
         arc = state["arc"]
-        chain = self.prompt | self.chat_model_service.chat_model
-        message: AIMessage = chain.invoke({"arc": state["arc"], "image": state["birthchart"].image_b64})
-        return ZiweiTellingState(messages=[message], analyses=[ZiweiArcAnalysis(arc=arc, analysis=message.content)])
+        chain = self.limit(self.prompt | self.chat_model_service.chat_model)
+        entry = self.ziwei_chart_cache.get(state["birthchart"])
+        info = "\n".join(ziwei_chart_info(entry.chart))
+        image = f"data:image/png;base64,{base64.b64encode(entry.tiles[arc]).decode()}"
+        message: AIMessage = chain.invoke({"arc": arc, "info": info, "image": image})
+        bot_messages = [TextMessage(message.content)] if self.stream else []
+        return ZiweiTellingState(
+            messages=[message], analyses=[ZiweiArcAnalysis(arc=arc, analysis=message.content)], bot_messages=bot_messages
+        )
+
+
+class AnalyzeZiweiArcs(ChatModelNode):
+    ziwei_chart_cache: ZiweiChartCache
+    system_message = SystemMessage(
+        content=dedent(
+            """
+            Bạn là một nhà chiêm tinh và chuyên gia tử vi đẩu số Việt Nam. Sử dụng lá số tử vi đẩu số sau đây làm ngữ cảnh, hãy phân tích và đưa ra những nhận định về lá số này.
+            Phân tích cần dựa trên kiến thức phong thủy và tử vi đẩu số truyền thống Việt Nam, kết hợp giữa các yếu tố âm dương, ngũ hành, cung mệnh và con giáp.
+            Hãy phân tích chi tiết lần lượt từng Cung được nêu trong yêu cầu, theo đúng thứ tự. Với mỗi Cung, hãy xác định đúng ô (cung) trên lá số, sau đó phân tích các sao, vị trí của sao, tương tác giữa các sao.
+            Khi trả lời, chỉ đưa ra phân tích, không đưa ra giới thiệu về cung. Ngoài ra không đưa ra thông tin gì thêm
+            """
+        )
+    )
+    human_message = HumanMessagePromptTemplate.from_template(
+        template=[
+            {"type": "text", "text": "Phân tích các Cung: {arcs}\n{info}"},
+            {"type": "image_url", "image_url": "{image}"},
+        ]
+    )
+    prompt = ChatPromptTemplate.from_messages([system_message, human_message])
+
+    def __init__(self, chat_model_service: ChatModelService, ziwei_chart_cache: ZiweiChartCache):
+        super().__init__(chat_model_service)
+        self.ziwei_chart_cache = ziwei_chart_cache
+
+    def __call__(self, state: ZiweiTellingState):
+        chain = self.limit(self.prompt | self.chat_model_service.chat_model.with_structured_output(ZiweiReading))
+        entry = self.ziwei_chart_cache.get(state["birthchart"])
+        reading: ZiweiReading = chain.invoke(
+            {
+                "arcs": ", ".join(MapAnalyzeZiweiArcs.arcs),
+                "info": "\n".join(ziwei_chart_info(entry.chart)),
+                "image": f"data:image/png;base64,{base64.b64encode(entry.image).decode()}",
+            }
+        )
+        analyses = [
+            ZiweiArcAnalysis(arc=analysis.arc, analysis=f"Cung: {analysis.arc}\nPhân tích: {analysis.analysis}")
+            for analysis in reading.analyses
+        ]
+        return ZiweiTellingState(messages=[AIMessage(content=analysis.analysis) for analysis in analyses], analyses=analyses)
 
 
 class DumpZiweiArcAnalysis:
@@ -102,39 +193,53 @@ class DumpZiweiArcAnalysis:
         return ZiweiTellingState(analysis_file=fo, bot_messages=[FileMessage(fo, "ziwei.txt", "Luận giải chi tiết")])
 
 
-class MapSummarizeZiwei:
-    node_id: str
-    sentiments: list[str] = [
-        "tích cực",
-        "tiêu cực",
-        "lời khuyên",
-    ]
-
-    def __init__(self, node_id: str):
-        self.node_id = node_id
-
-    def __call__(self, state: ZiweiTellingState):
-        return [Send(self.node_id, ZiweiSummaryState(analyses=state["analyses"], sentiment=sentiment)) for sentiment in self.sentiments]
-
-
 class SummarizeZiwei(ChatModelNode):
-    system_message = SystemMessagePromptTemplate.from_template(
-        dedent(
+    system_message = SystemMessage(
+        content=dedent(
             """
             Bạn là một nhà chiêm tinh và chuyên gia tử vi đẩu số Việt Nam.
             Ở tin nhắn trước bạn đã phân tích tất cả các Cung của 1 lá số của một người.
             Hãy sử dụng ngữ cảnh được cung cấp (phân tích các Cung của lá số)
-            Đưa ra 5 điểm {sentiment} nhất, giải thích theo ngôn ngữ dễ hiểu.
-            Trả lời theo bullet points, đúng 5 bullet points
+            Đưa ra 5 điểm tích cực nhất, 5 điểm tiêu cực nhất và 5 lời khuyên quan trọng nhất, giải thích theo ngôn ngữ dễ hiểu.
+            """
+        )
+    )
+    prompt = ChatPromptTemplate.from_messages([system_message, MessagesPlaceholder("analyses")])
+    compress_system_message = SystemMessage(
+        content=dedent(
+            """
+            Bạn là một nhà chiêm tinh và chuyên gia tử vi đẩu số Việt Nam.
+            Hãy tóm tắt ngắn gọn các phân tích Cung sau đây, giữ lại tên Cung và những nhận định quan trọng nhất.
+            Không đưa ra thông tin gì thêm
             """
         )
     )
-    prompt = ChatPromptTemplate.from_messages([system_message])
+    compress_prompt = ChatPromptTemplate.from_messages([compress_system_message, MessagesPlaceholder("analyses")])
+    token_budget = TokenBudget(max_tokens=8000)
+    max_compressions = 2
+
+    def __init__(self, chat_model_service: ChatModelService):
+        super().__init__(chat_model_service)
+        self.chain = self.limit(self.prompt | self.chat_model_service.chat_model.with_structured_output(ZiweiSentimentSummary))
+        self.compress_chain = self.limit(self.compress_prompt | self.chat_model_service.chat_model)
+
+    def compress(self, analyses: list[str]) -> list[str]:
+        for _ in range(self.max_compressions):
+            if sum(self.token_budget.count(analysis) for analysis in analyses) <= self.token_budget.max_tokens:
+                return analyses
+            chunks = self.token_budget.chunk(analyses)
+            messages: list[AIMessage] = self.compress_chain.batch(
+                [{"analyses": [HumanMessage(content=analysis) for analysis in chunk]} for chunk in chunks]
+            )
+            analyses = [message.content for message in messages]
+        return self.token_budget.fit(analyses)
 
-    def __call__(self, state: ZiweiSummaryState):
-        for analysis in state["analyses"]:
-            human_message = HumanMessagePromptTemplate.from_template(analysis.analysis)
-            self.prompt.extend([human_message])
-        chain = self.prompt | self.chat_model_service.chat_model
-        message: AIMessage = chain.invoke({"sentiment": state["sentiment"]})
-        return ZiweiTellingState(messages=[message], summaries=[message.content], bot_messages=[TextMessage(message.content)])
+    def __call__(self, state: ZiweiTellingState):
+        analyses = self.compress([analysis.analysis for analysis in state["analyses"]])
+        summary: ZiweiSentimentSummary = self.chain.invoke({"analyses": [HumanMessage(content=analysis) for analysis in analyses]})
+        summaries = ["\n".join(f"- {point}" for point in points) for points in [summary.positives, summary.negatives, summary.advices]]
+        return ZiweiTellingState(
+            messages=[AIMessage(content=content) for content in summaries],
+            summaries=summaries,
+            bot_messages=[TextMessage(content) for content in summaries],
+        )
@@ -0,0 +1,101 @@
+import re
+import unicodedata
+
+from app.ziwei.ziwei_lunar import LunarDate, lunar_to_solar
+from app.ziwei.ziwei_model import ZiweiBirthchart
+
+DATE_PATTERNS = [
+    re.compile(r"(?<!\d)(?P<year>\d{4})[-/.](?P<month>\d{1,2})[-/.](?P<day>\d{1,2})(?!\d)"),
+    re.compile(r"(?<!\d)(?P<day>\d{1,2})[-/.](?P<month>\d{1,2})[-/.](?P<year>\d{4})(?!\d)"),
+    re.compile(r"ngày\s*(?P<day>\d{1,2})\s*tháng\s*(?P<month>\d{1,2})\s*(?:năm\s*)?(?P<year>\d{4})(?!\d)"),
+]
+TIME_PATTERN = re.compile(
+    r"(?<!\d)(?P<hour>\d{1,2})\s*(?::|h|giờ)\s*(?:(?P<minute>\d{1,2})(?!\d)\s*(?:phút|p)?)?\s*(?P<period>sáng|trưa|chiều|tối|đêm)?"
+)
+BRANCH_PATTERN = re.compile(r"giờ\s+(?P<branch>tý|sửu|dần|mão|mẹo|thìn|tỵ|tị|ngọ|mùi|thân|dậu|tuất|hợi)\b")
+BRANCH_HOURS = {
+    "tý": 0,
+    "sửu": 2,
+    "dần": 4,
+    "mão": 6,
+    "mẹo": 6,
+    "thìn": 8,
+    "tỵ": 10,
+    "tị": 10,
+    "ngọ": 12,
+    "mùi": 14,
+    "thân": 16,
+    "dậu": 18,
+    "tuất": 20,
+    "hợi": 22,
+}
+# "nam" is also south (miền Nam, Việt Nam), so a gender word needs context or has to stand alone beside the date and time
+FEMALE_PATTERN = re.compile(
+    r"\b(?:giới tính\s*(?:là|:)?\s*(?:nữ|nu)|(?:nữ|nu)\s+(?:giới|mạng|sinh)|mạng\s+(?:nữ|nu)|(?:con|bé)\s+gái|female)\b"
+    r"|(?:^|[,;(§])\s*(?:nữ|nu|gái)\s*(?=$|[,;)§])"
+)
+MALE_PATTERN = re.compile(
+    r"\b(?:giới tính\s*(?:là|:)?\s*nam|nam\s+(?:giới|mạng|sinh)|mạng\s+nam|(?:con|bé)\s+trai|male)\b"
+    r"|(?:^|[,;(§])\s*(?:nam|trai)\s*(?=$|[,;)§])"
+)
+PARSED_MARK = " § "
+LUNAR_PATTERN = re.compile(r"\b(?:âm lịch|âm|al)\b")
+LEAP_PATTERN = re.compile(r"\bnhuận\b")
+
+
+def parse_date(text: str) -> tuple[tuple[int, int, int], str] | None:
+    for pattern in DATE_PATTERNS:
+        match = pattern.search(text)
+        if match:
+            date = (int(match["year"]), int(match["month"]), int(match["day"]))
+            return date, text[: match.start()] + PARSED_MARK + text[match.end() :]
+    return None
+
+
+def parse_time(text: str) -> tuple[int, int] | None:
+    match = BRANCH_PATTERN.search(text)
+    if match:
+        return BRANCH_HOURS[match["branch"]], 0
+
+    match = TIME_PATTERN.search(text)
+    if not match:
+        return None
+    hour, minute = int(match["hour"]), int(match["minute"] or 0)
+    period = match["period"]
+    if period == "chiều" and hour < 12 or period == "tối" and 6 <= hour < 12 or period == "trưa" and hour < 6:
+        hour += 12
+    elif period == "đêm" and hour == 12:
+        hour = 0
+    elif period == "đêm" and 6 <= hour < 12:
+        hour += 12
+    return hour, minute
+
+
+def parse_gender(text: str) -> int | None:
+    text = TIME_PATTERN.sub(PARSED_MARK, BRANCH_PATTERN.sub(PARSED_MARK, text))
+    female, male = FEMALE_PATTERN.search(text), MALE_PATTERN.search(text)
+    if bool(female) == bool(male):
+        return None
+    return 0 if female else 1
+
+
+def parse_ziwei_birthchart(text: str) -> ZiweiBirthchart | None:
+    text = unicodedata.normalize("NFC", text).lower()
+
+    parsed_date = parse_date(text)
+    if not parsed_date:
+        return None
+    (year, month, day), rest = parsed_date
+    time, gender = parse_time(rest), parse_gender(rest)
+    if time is None or gender is None:
+        return None
+    hour, minute = time
+
+    if LUNAR_PATTERN.search(rest):
+        try:
+            solar_date = lunar_to_solar(LunarDate(year=year, month=month, day=day, is_leap=bool(LEAP_PATTERN.search(rest))))
+        except ValueError:
+            return ZiweiBirthchart(year=year, month=month, day=day, hour=hour, minute=minute, gender=gender, error=True)
+        year, month, day = solar_date.year, solar_date.month, solar_date.day
+
+    return ZiweiBirthchart(year=year, month=month, day=day, hour=hour, minute=minute, gender=gender)
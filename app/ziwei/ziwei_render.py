@@ -0,0 +1,116 @@
+from functools import lru_cache
+from io import BytesIO
+
+from PIL import Image, ImageDraw, ImageFont
+
+from app.ziwei.ziwei_chart import BRANCHES, STEMS, ZiweiChart, ZiweiPalace
+
+FONT_PATHS = {
+    False: "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf",
+    True: "/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf",
+}
+
+# (column, row) of each branch on the 4x4 chart grid, the 2x2 center holds the birth info
+CELLS = {
+    5: (0, 0),
+    6: (1, 0),
+    7: (2, 0),
+    8: (3, 0),
+    9: (3, 1),
+    10: (3, 2),
+    11: (3, 3),
+    0: (2, 3),
+    1: (1, 3),
+    2: (0, 3),
+    3: (0, 2),
+    4: (0, 1),
+}
+CELL_SIZE = 300
+PADDING = 10
+
+
+@lru_cache(maxsize=8)
+def load_font(size: int, bold: bool = False) -> ImageFont.FreeTypeFont:
+    try:
+        return ImageFont.truetype(FONT_PATHS[bold], size)
+    except OSError:
+        return ImageFont.load_default(size)
+
+
+def cell_box(branch: int) -> tuple[int, int, int, int]:
+    col, row = CELLS[branch]
+    return (col * CELL_SIZE, row * CELL_SIZE, (col + 1) * CELL_SIZE, (row + 1) * CELL_SIZE)
+
+
+def center_box() -> tuple[int, int, int, int]:
+    return (CELL_SIZE, CELL_SIZE, 3 * CELL_SIZE, 3 * CELL_SIZE)
+
+
+def draw_palace(draw: ImageDraw.ImageDraw, palace: ZiweiPalace):
+    left, top, right, bottom = cell_box(palace.branch)
+    draw.rectangle((left, top, right, bottom), outline="black", width=2)
+
+    draw.text((left + PADDING, top + PADDING), palace.title, font=load_font(16), fill="dimgray")
+    draw.text((right - PADDING, top + PADDING), str(palace.decade), font=load_font(16), fill="dimgray", anchor="ra")
+    name = f"{palace.name} (Thân)" if palace.is_body else palace.name
+    draw.text(((left + right) // 2, top + 36), name.upper(), font=load_font(18, bold=True), fill="black", anchor="ma")
+
+    y = top + 66
+    for star in palace.major_stars:
+        draw.text(((left + right) // 2, y), star, font=load_font(18, bold=True), fill="darkred", anchor="ma")
+        y += 24
+
+    y += 6
+    font = load_font(14)
+    for i, star in enumerate(palace.minor_stars):
+        x = left + PADDING if i % 2 == 0 else (left + right) // 2
+        draw.text((x, y), star, font=font, fill="navy")
+        if i % 2 == 1:
+            y += 19
+
+    draw.text(((left + right) // 2, bottom - PADDING), palace.trang_sinh, font=load_font(14), fill="darkgreen", anchor="md")
+
+
+def ziwei_chart_info(chart: ZiweiChart) -> list[str]:
+    lunar_date = chart.lunar_date
+    return [
+        f"Dương lịch: {chart.day:02d}/{chart.month:02d}/{chart.year}",
+        f"Âm lịch: {lunar_date.day:02d}/{lunar_date.month:02d}{' (nhuận)' if lunar_date.is_leap else ''}/{lunar_date.year}",
+        f"Năm: {STEMS[chart.year_stem]} {BRANCHES[chart.year_branch]}",
+        f"Giờ: {BRANCHES[chart.hour_branch]}",
+        f"{'Dương' if chart.is_yang else 'Âm'} {'Nam' if chart.gender else 'Nữ'}",
+        f"Bản mệnh: {chart.nap_am}",
+        f"Cục: {chart.cuc}",
+        f"Thân cư: {chart.palace_by_branch(chart.than_branch).name}",
+    ]
+
+
+def draw_center(draw: ImageDraw.ImageDraw, chart: ZiweiChart):
+    left, top, right, bottom = center_box()
+    draw.rectangle((left, top, right, bottom), outline="black", width=2)
+
+    lines = ziwei_chart_info(chart)
+    draw.text(((left + right) // 2, top + 40), "LÁ SỐ TỬ VI", font=load_font(28, bold=True), fill="darkred", anchor="ma")
+    y = top + 110
+    for line in lines:
+        draw.text(((left + right) // 2, y), line, font=load_font(20), fill="black", anchor="ma")
+        y += 40
+
+
+def render_ziwei_chart(chart: ZiweiChart) -> Image.Image:
+    image = Image.new("RGB", (4 * CELL_SIZE, 4 * CELL_SIZE), "white")
+    draw = ImageDraw.Draw(image)
+    for palace in chart.palaces:
+        draw_palace(draw, palace)
+    draw_center(draw, chart)
+    return image
+
+
+def encode_ziwei_chart(image: Image.Image, format_: str = "PNG") -> bytes:
+    buffer = BytesIO()
+    image.save(buffer, format=format_, optimize=True)
+    return buffer.getvalue()
+
+
+def crop_ziwei_palaces(image: Image.Image, chart: ZiweiChart) -> dict[str, bytes]:
+    return {palace.name: encode_ziwei_chart(image.crop(cell_box(palace.branch))) for palace in chart.palaces}
@@ -14,8 +14,3 @@ class ZiweiTellingState(BotMessagesState):
 class ZiweiArcAnalysisState(TypedDict):
     birthchart: ZiweiBirthchart
     arc: str
-
-
-class ZiweiSummaryState(TypedDict):
-    sentiment: str
-    analyses: list[ZiweiArcAnalysis]
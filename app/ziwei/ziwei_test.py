@@ -1,18 +1,200 @@
+import asyncio
+import base64
+from datetime import date
+from io import BytesIO
+from types import SimpleNamespace
+
 import pytest
+from PIL import Image
+from langchain_core.messages import AIMessage, HumanMessage
 
 from app.core.chat_model import ChatModelService
-from app.ziwei.ziwei_graph import ZiweiGraphService
+from app.core.database import MongoDBService
+from app.ziwei.ziwei_cache import ZiweiChartCache, ZiweiChartEntry
+from app.ziwei.ziwei_chart import BRANCHES, build_ziwei_chart, canonicalize_ziwei_birthdata
+from app.ziwei.ziwei_graph import ZiweiGraphMode, ZiweiGraphService
+from app.ziwei.ziwei_lunar import LunarDate, compute_lunar_date, jd_from_date, lunar_to_solar, solar_to_lunar
+from app.ziwei.ziwei_model import ZiweiArcAnalysis, ZiweiBirthchart, ZiweiSentimentSummary
+from app.ziwei.ziwei_node import AnalyzeZiweiArc, ExtractZiweiBirthchart, MapAnalyzeZiweiArcs, SummarizeZiwei
+from app.ziwei.ziwei_parser import parse_ziwei_birthchart
+from app.ziwei.ziwei_render import CELL_SIZE, crop_ziwei_palaces, encode_ziwei_chart, render_ziwei_chart
+from app.ziwei.ziwei_state import ZiweiArcAnalysisState, ZiweiTellingState
 
 
 class TestZiwei:
     @pytest.fixture
-    def ziwei_graph_service(self, chat_model_service: ChatModelService):
-        return ZiweiGraphService(chat_model_service)
+    def ziwei_chart_cache(self, mongodb_service: MongoDBService):
+        return ZiweiChartCache(mongodb_service)
+
+    @pytest.fixture
+    def ziwei_graph_service(self, chat_model_service: ChatModelService, ziwei_chart_cache: ZiweiChartCache):
+        return ZiweiGraphService(chat_model_service, ziwei_chart_cache)
 
     @pytest.fixture
     def question(self):
         return "1997-11-19 23:35 nữ mạng"
 
+    def run_graph(self, ziwei_graph_service: ZiweiGraphService, question: str):
+        async def run():
+            async for node, state in ziwei_graph_service.run(question):
+                print(f">>> {node}")
+
+        asyncio.run(run())
+
     def test_graph(self, ziwei_graph_service: ZiweiGraphService, question: str):
-        for node, state in ziwei_graph_service.run(question):
-            print(f">>> {node}")
+        self.run_graph(ziwei_graph_service, question)
+
+    def test_graph_single(self, chat_model_service: ChatModelService, ziwei_chart_cache: ZiweiChartCache, question: str):
+        self.run_graph(ZiweiGraphService(chat_model_service, ziwei_chart_cache, mode=ZiweiGraphMode.single), question)
+
+    @pytest.mark.parametrize(
+        ("solar", "lunar"),
+        [
+            ((19, 11, 1997), LunarDate(year=1997, month=10, day=20, is_leap=False)),
+            ((10, 2, 2024), LunarDate(year=2024, month=1, day=1, is_leap=False)),
+            ((25, 5, 2020), LunarDate(year=2020, month=4, day=3, is_leap=True)),
+        ],
+    )
+    def test_solar_to_lunar(self, solar: tuple[int, int, int], lunar: LunarDate):
+        assert solar_to_lunar(*solar) == lunar
+        assert compute_lunar_date(jd_from_date(*solar), solar[2]) == lunar
+        assert lunar_to_solar(lunar) == date(solar[2], solar[1], solar[0])
+
+    def test_canonicalize(self):
+        birthdata = canonicalize_ziwei_birthdata(1997, 11, 19, 23, 35, 0)
+        assert birthdata == canonicalize_ziwei_birthdata(1997, 11, 19, 23, 5, 0)
+        assert birthdata != canonicalize_ziwei_birthdata(1997, 11, 19, 21, 35, 0)
+        assert birthdata.key == "1997-10-20:00:0"
+
+        for invalid in [(1997, 2, 30, 10, 0, 0), (1997, 11, 19, 24, 0, 0), (1800, 1, 1, 0, 0, 1), (1997, 11, 19, 10, 0, 2)]:
+            with pytest.raises(ValueError):
+                canonicalize_ziwei_birthdata(*invalid)
+
+    @pytest.mark.parametrize(
+        ("text", "birthchart"),
+        [
+            ("1997-11-19 23:35 nữ mạng", (1997, 11, 19, 23, 35, 0)),
+            ("19/11/1997 23h35 nữ", (1997, 11, 19, 23, 35, 0)),
+            ("ngày 19 tháng 11 năm 1997, 11 giờ 35 tối, nữ", (1997, 11, 19, 23, 35, 0)),
+            ("Nam sinh 5.3.1990 giờ Tý", (1990, 3, 5, 0, 0, 1)),
+            ("2 giờ chiều 01-01-2000 nam", (2000, 1, 1, 14, 0, 1)),
+            ("20/10/1997 âm lịch 23:35 nữ", (1997, 11, 19, 23, 35, 0)),
+            ("3/4/2020 âm lịch nhuận 8h sáng nam", (2020, 5, 25, 8, 0, 1)),
+            ("19/11/1997 nữ", None),
+            ("sinh năm 1997, giờ Tý, nam", None),
+            ("Giới tính: nam, 01/01/2000 8h sáng", (2000, 1, 1, 8, 0, 1)),
+            ("nam giới, sinh 01/01/2000 8h sáng ở Hà Nội", (2000, 1, 1, 8, 0, 1)),
+            ("con gái, sinh ở miền nam 19/11/1997 23:35", (1997, 11, 19, 23, 35, 0)),
+            ("19/11/1997 23:35 sinh ở Việt Nam, nữ", (1997, 11, 19, 23, 35, 0)),
+            ("sinh ở miền nam 19/11/1997 23:35", None),
+            ("01/01/2000 8h sáng, quê Việt Nam", None),
+        ],
+    )
+    def test_parse_birthchart(self, text: str, birthchart: tuple[int, ...] | None):
+        parsed = parse_ziwei_birthchart(text)
+        assert (parsed and (parsed.year, parsed.month, parsed.day, parsed.hour, parsed.minute, parsed.gender)) == birthchart
+
+    def test_extract_fallback(self, fake_chat_model_service):
+        def chat_model(prompt):
+            return ZiweiBirthchart(year=1997, month=11, day=19, hour=23, minute=35, gender=0)
+
+        extract_ziwei_birthchart = ExtractZiweiBirthchart(fake_chat_model_service(structured_output=chat_model))
+        for question in ["19/11/1997 23:35 nữ", "30/02/1997 10:00 nam", "mười chín tháng mười một, chín bảy"]:
+            extract_ziwei_birthchart(ZiweiTellingState(messages=[HumanMessage(content=question)]))
+
+        assert extract_ziwei_birthchart.stats() == {"parsed": 2, "fallbacks": 1}
+        state = extract_ziwei_birthchart(ZiweiTellingState(messages=[HumanMessage(content="30/02/1997 10:00 nam")]))
+        assert state["birthchart"].error
+
+    def test_chart(self):
+        chart = build_ziwei_chart(canonicalize_ziwei_birthdata(1997, 11, 19, 23, 35, 0))
+
+        assert BRANCHES[chart.menh_branch] == "Hợi"
+        assert chart.cuc == "Kim Tứ Cục"
+        assert len(chart.palaces) == 12
+        assert "Tử Vi" in chart.palace_by_branch(BRANCHES.index("Ngọ")).major_stars
+
+        image = render_ziwei_chart(chart)
+        assert Image.open(BytesIO(encode_ziwei_chart(image))).size == (4 * CELL_SIZE, 4 * CELL_SIZE)
+
+        tiles = crop_ziwei_palaces(image, chart)
+        assert list(tiles) == MapAnalyzeZiweiArcs.arcs
+        assert all(Image.open(BytesIO(tile)).size == (CELL_SIZE, CELL_SIZE) for tile in tiles.values())
+
+    def test_analyze_arc_tile(self, fake_chat_model_service):
+        prompts = []
+
+        def chat_model(prompt):
+            prompts.append(prompt.to_messages())
+            return AIMessage(content="Cung: Mệnh")
+
+        birthchart = ZiweiBirthchart(year=1997, month=11, day=19, hour=23, minute=35, gender=0)
+        chart = build_ziwei_chart(birthchart.birthdata())
+        image = render_ziwei_chart(chart)
+        entry = ZiweiChartEntry(chart, encode_ziwei_chart(image), crop_ziwei_palaces(image, chart))
+        ziwei_chart_cache = SimpleNamespace(get=lambda _: entry)
+
+        chat_model_service = fake_chat_model_service(chat_model)
+        analyze_ziwei_arc = AnalyzeZiweiArc(chat_model_service, ziwei_chart_cache)
+        for arc in MapAnalyzeZiweiArcs.arcs:
+            assert not analyze_ziwei_arc(ZiweiArcAnalysisState(birthchart=birthchart, arc=arc))["bot_messages"]
+
+        for arc, prompt in zip(MapAnalyzeZiweiArcs.arcs, prompts):
+            text, image = prompt[-1].content
+            assert text["text"].startswith(f"Phân tích Cung {arc}\n") and "Cục: Kim Tứ Cục" in text["text"]
+            assert image["image_url"]["url"] == f"data:image/png;base64,{base64.b64encode(entry.tiles[arc]).decode()}"
+
+        state = AnalyzeZiweiArc(chat_model_service, ziwei_chart_cache, stream=True)(
+            ZiweiArcAnalysisState(birthchart=birthchart, arc="Mệnh")
+        )
+        assert [bot_message.text for bot_message in state["bot_messages"]] == ["Cung: Mệnh"]
+
+    def test_chart_cache(self, ziwei_chart_cache: ZiweiChartCache):
+        birthchart = ZiweiBirthchart(year=1997, month=11, day=19, hour=23, minute=35, gender=0)
+        entry = ziwei_chart_cache.get(birthchart)
+        assert ziwei_chart_cache.get(birthchart) == entry
+        assert ziwei_chart_cache.get(birthchart.model_copy(update={"minute": 5})) == entry
+        assert ziwei_chart_cache.hits == 2
+
+        ziwei_chart_cache.charts.clear()
+        assert ziwei_chart_cache.get(birthchart) == entry
+        assert ziwei_chart_cache.persistent_hits == 1
+        assert ziwei_chart_cache.collection.find_one({"_id": birthchart.birthdata().key})["expires_at"]
+
+    def summarize_ziwei(self, prompts: list, fake_chat_model_service):
+        def compress(prompt):
+            prompts.append(prompt.to_messages())
+            return AIMessage(content="{compressed}")
+
+        def summarize(prompt):
+            prompts.append(prompt.to_messages())
+            return ZiweiSentimentSummary(positives=["tốt"] * 5, negatives=["xấu"] * 5, advices=["nên"] * 5)
+
+        return SummarizeZiwei(fake_chat_model_service(compress, summarize))
+
+    def test_summarize_sections(self, fake_chat_model_service):
+        prompts = []
+        summarize_ziwei = self.summarize_ziwei(prompts, fake_chat_model_service)
+        analyses = [ZiweiArcAnalysis(arc=arc, analysis=f"Cung: {arc}") for arc in MapAnalyzeZiweiArcs.arcs]
+
+        state = summarize_ziwei(ZiweiTellingState(analyses=analyses))
+
+        assert len(prompts) == 1
+        assert [message.content for message in prompts[0][1:]] == [analysis.analysis for analysis in analyses]
+        assert state["summaries"] == ["\n".join(["- tốt"] * 5), "\n".join(["- xấu"] * 5), "\n".join(["- nên"] * 5)]
+        assert [bot_message.text for bot_message in state["bot_messages"]] == state["summaries"]
+
+    def test_summarize_bounded(self, fake_chat_model_service):
+        prompts = []
+        summarize_ziwei = self.summarize_ziwei(prompts, fake_chat_model_service)
+        analyses = [ZiweiArcAnalysis(arc=arc, analysis="{sao} " * 2000) for arc in MapAnalyzeZiweiArcs.arcs]
+        state = ZiweiTellingState(analyses=analyses)
+
+        summarize_ziwei(state)
+        first_call = len(prompts)
+        summarize_ziwei(state)
+
+        assert len(prompts) == 2 * first_call
+        assert prompts[first_call - 1] == prompts[-1]
+        assert all(len(prompt) <= len(analyses) + 1 for prompt in prompts)
+        assert sum(summarize_ziwei.token_budget.count(m.content) for m in prompts[-1][1:]) <= summarize_ziwei.token_budget.max_tokens